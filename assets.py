@@ -0,0 +1,351 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+import images
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+logger = logging.getLogger("chat")
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json", "image/svg+xml")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+
+class Asset:
+    """One static file held in memory with precompressed variants and strong ETags"""
+
+    def __init__(self, name: str, body: bytes, media_type: str):
+        self.name = name
+        self.media_type = media_type
+        digest = hashlib.sha256(body).hexdigest()
+        self.fingerprint = digest[:12]
+        stem, ext = os.path.splitext(name)
+        self.fingerprinted_name = f"{stem}.{self.fingerprint}{ext}"
+        # encoding -> (body, etag); every representation needs its own strong ETag
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{digest[:32]}"')}
+        if media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = (compressed, f'"{digest[:32]}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants["br"] = (compressed, f'"{digest[:32]}-br"')
+
+
+class ResponsiveImage:
+    """An image with resized, re-encoded variants, picked per request by Accept and client hints"""
+
+    def __init__(self, original: Asset, size: Optional[Tuple[int, int]]):
+        self.original = original
+        self.aspect = size[0] / size[1] if size else 16 / 9
+        # (width, media type, asset), narrowest first
+        self.variants: List[Tuple[int, str, Asset]] = []
+
+    def add(self, width: int, media_type: str, asset: Asset) -> None:
+        self.variants.append((width, media_type, asset))
+        self.variants.sort(key=lambda variant: variant[0])
+
+    def choose(self, request: Request) -> Asset:
+        """The narrowest variant that covers the viewport, in the most compact format the browser accepts"""
+        if not self.variants:
+            return self.original
+        accept = request.headers.get("accept", "")
+        types = [media_type for _, media_type, _, _ in images.FORMATS
+                 if media_type == "image/jpeg" or media_type in accept]
+        # Without client hints, e.g. from Safari or Firefox, assume a typical desktop screen
+        needed = images.target_width(request.headers, self.aspect) or 1920
+        # The widest variant stands in for anything larger; the original is usually far heavier
+        width = next((width for width, _, _ in self.variants if width >= needed), self.variants[-1][0])
+        for media_type in types:
+            for variant_width, variant_type, asset in self.variants:
+                if variant_width == width and variant_type == media_type:
+                    return asset
+        return self.original
+
+
+def accepted_encodings(header: str) -> set:
+    encodings = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(coding.lower())
+    return encodings
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Return (start, end) inclusive for a single satisfiable byte range, or None for unsatisfiable
+
+    Raises ValueError for headers we don't handle (multiple ranges, other units), which callers
+    answer with the full body as RFC 9110 allows.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError(header)
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        length = int(last)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def minify_css(css: str) -> str:
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    # Not around ":" -- "a :hover" and "a:hover" are different selectors
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify_js(js: str) -> str:
+    """Drop indentation, blank lines and whole-line comments; newlines stay so ASI is unaffected"""
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    lines = (line.strip() for line in js.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+def minify_json(text: str) -> str:
+    return json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":"))
+
+
+def minify_html(html: str) -> str:
+    html = re.sub(r"<!--.*?-->", "", html, flags=re.S)
+    return re.sub(r"\s*\n\s*", "\n", html).strip()
+
+
+class AssetStore:
+    """Static files loaded once at startup and answered from memory"""
+
+    def __init__(self):
+        self.assets: Dict[str, Asset] = {}
+        self.fingerprinted: Dict[str, Asset] = {}
+        self.responsive: Dict[str, ResponsiveImage] = {}
+        # Names rewritten to a fixed URL instead of an asset's, e.g. an inlined data: URI
+        self.aliases: Dict[str, str] = {}
+
+    def load(self, path: str, media_type: str, name: Optional[str] = None) -> Optional[Asset]:
+        try:
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError as e:
+            logger.warning("Static asset %s not loaded: %s", path, e)
+            return None
+        return self.add(name or os.path.basename(path), body, media_type)
+
+    def add(self, name: str, body: bytes, media_type: str) -> Asset:
+        asset = Asset(name, body, media_type)
+        self.assets[name] = asset
+        self.fingerprinted[asset.fingerprinted_name] = asset
+        return asset
+
+    def url(self, name: str) -> str:
+        """Cache-busting URL for an asset, falling back to the plain name if it isn't loaded"""
+        if name in self.aliases:
+            return self.aliases[name]
+        asset = self.assets.get(name)
+        return f"/assets/{asset.fingerprinted_name}" if asset else f"/{name}"
+
+    def rewrite(self, text: str) -> str:
+        """Point quoted references to loaded assets at their fingerprinted URLs"""
+        for name in [*self.assets, *self.aliases]:
+            url = self.url(name)
+            text = text.replace(f'"{name}"', f'"{url}"').replace(f"'{name}'", f"'{url}'")
+        return text
+
+    def load_responsive(self, path: str, media_type: str) -> Optional[ResponsiveImage]:
+        """Load an image with its size variants and a blurred placeholder
+
+        Variants pre-encoded by `python images.py <path>` (or by serve.py before it starts workers)
+        are read from disk; if there are none and Pillow is installed, they are encoded here, which
+        takes seconds, so call this off the event loop. The placeholder is inlined wherever the
+        frontend refers to "<stem>-placeholder.jpg", falling back to the image itself.
+        """
+        original = self.load(path, media_type)
+        if original is None:
+            return None
+        directory, name = os.path.split(path)
+        body = original.variants["identity"][0]
+        image = ResponsiveImage(original, images.image_size(body))
+        self.responsive[name] = image
+
+        encoded: Dict[str, bytes] = {}
+        for width in images.BACKGROUND_WIDTHS:
+            for ext, _, _, _ in images.FORMATS:
+                variant = images.variant_name(name, width, ext)
+                try:
+                    with open(os.path.join(directory, variant), "rb") as f:
+                        encoded[variant] = f.read()
+                except OSError:
+                    pass
+        placeholder_name = images.variant_name(name, images.PLACEHOLDER_WIDTH, "jpg")
+        placeholder = None
+        try:
+            with open(os.path.join(directory, placeholder_name), "rb") as f:
+                placeholder = f.read()
+        except OSError:
+            pass
+        if images.Image is not None:
+            try:
+                if not encoded:
+                    logger.warning("Variants of %s were not pre-encoded, encoding them now; "
+                                   "run `python images.py %s` once to skip this at startup", name, path)
+                    encoded = images.encode_variants(name, body)
+                if placeholder is None:
+                    placeholder = images.encode_placeholder(body)
+            except (OSError, ValueError) as e:
+                logger.warning("Could not encode variants of %s: %s", name, e)
+        elif not encoded:
+            logger.info("Pillow is not installed; serving %s at its original size only", name)
+
+        for width in images.BACKGROUND_WIDTHS:
+            for ext, variant_type, _, _ in images.FORMATS:
+                variant = images.variant_name(name, width, ext)
+                if variant in encoded:
+                    image.add(width, variant_type, self.add(variant, encoded[variant], variant_type))
+
+        stem = os.path.splitext(name)[0]
+        self.aliases[f"{stem}-placeholder.jpg"] = (
+            images.data_uri(placeholder, "image/jpeg") if placeholder else f"/{name}"
+        )
+        return image
+
+    def load_frontend(self, directory: str) -> Optional[Asset]:
+        """Minify and fingerprint the page's stylesheet, script and manifest, then the page that links them
+
+        The service worker is built last, once every URL it precaches is known.
+        """
+        bundle = (("styles.css", "text/css; charset=utf-8", minify_css),
+                  ("app.js", "application/javascript; charset=utf-8", minify_js),
+                  ("icon.svg", "image/svg+xml", str.strip),
+                  ("manifest.webmanifest", "application/manifest+json", minify_json),
+                  ("index.html", "text/html; charset=utf-8", minify_html))
+        page = None
+        for name, media_type, minify in bundle:
+            text = self._read_frontend(directory, name)
+            if text is None:
+                continue
+            # Later files are rewritten against everything loaded before them
+            asset = self.add(name, minify(self.rewrite(text)).encode("utf-8"), media_type)
+            if name == "index.html":
+                page = asset
+        self.load_service_worker(directory)
+        return page
+
+    @staticmethod
+    def _read_frontend(directory: str, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning("Frontend file %s not loaded: %s", name, e)
+            return None
+
+    def load_service_worker(self, directory: str) -> Optional[Asset]:
+        """Fill in sw.js with the app shell's URLs and a version derived from their content hashes
+
+        The page is precached under "/", where it is served; everything else under its fingerprinted URL.
+        """
+        text = self._read_frontend(directory, "sw.js")
+        if text is None:
+            return None
+        # Responsive images are negotiated per device, so they are cached as they are fetched instead
+        skip = {"index.html", "sw.js", "favicon.ico"}
+        for image in self.responsive.values():
+            skip.add(image.original.name)
+            skip.update(asset.name for _, _, asset in image.variants)
+        precache = ["/"] + [self.url(name) for name in sorted(self.assets) if name not in skip]
+        hashes = "".join(self.assets[name].fingerprint for name in sorted(self.assets) if name != "sw.js")
+        version = hashlib.sha256(hashes.encode("ascii")).hexdigest()[:12]
+        text = text.replace("'__VERSION__'", json.dumps(version)).replace("__PRECACHE__", json.dumps(precache))
+        return self.add("sw.js", minify_js(text).encode("utf-8"), "application/javascript; charset=utf-8")
+
+    def response(self, request: Request, asset: Optional[Asset], immutable: bool = False,
+                 vary: Optional[str] = None) -> Response:
+        if asset is None:
+            return Response(status_code=404)
+
+        encoding = "identity"
+        if len(asset.variants) > 1:
+            accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+            for candidate in ("br", "gzip"):
+                if candidate in asset.variants and candidate in accepted:
+                    encoding = candidate
+                    break
+        body, etag = asset.variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+            "Accept-Ranges": "bytes",
+        }
+        if len(asset.variants) > 1:
+            vary = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+        if vary:
+            headers["Vary"] = vary
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        status = 200
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(range_header, len(body))
+            except ValueError:
+                byte_range = (0, len(body) - 1)
+            if byte_range is None:
+                headers["Content-Range"] = f"bytes */{len(body)}"
+                return Response(status_code=416, headers=headers)
+            start, end = byte_range
+            if (start, end) != (0, len(body) - 1):
+                status = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+                body = body[start:end + 1]
+
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=status, headers=headers, media_type=asset.media_type)
+        return Response(content=body, status_code=status, headers=headers, media_type=asset.media_type)
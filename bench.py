@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+
+# Benchmark for the /api/chat streaming path that needs no network: it starts mock_upstream.py
+# and the chat server locally, drives them with N concurrent clients and writes a JSON report
+# that can be compared across commits.
+#   python bench.py                                  # 10, 100, 1000 and 10000 clients over HTTP
+#   python bench.py --mode direct --concurrency 100  # stream_openrouter_response in-process, no HTTP
+#   python bench.py --target http://host:8000        # an already running server (no CPU/memory figures)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentiles(values: Sequence[float], scale: float = 1000.0) -> Dict[str, Optional[float]]:
+    """Nearest-rank percentiles, in milliseconds by default"""
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * scale, 3)
+
+    return {"p50": rank(0.5), "p90": rank(0.9), "p99": rank(0.99), "max": round(ordered[-1] * scale, 3),
+            "mean": round(sum(ordered) / len(ordered) * scale, 3)}
+
+
+class ProcessSampler:
+    """CPU time and peak RSS of one process, read from /proc while a level runs"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def _sample(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            await asyncio.sleep(0.1)
+
+    def start(self) -> None:
+        self.baseline_rss = self.rss()
+        self.peak_rss = self.baseline_rss
+        self.started_cpu = self.cpu_seconds()
+        self._task = asyncio.create_task(self._sample())
+
+    def stop(self) -> Dict[str, float]:
+        self._task.cancel()
+        return {
+            "cpu_seconds": round(self.cpu_seconds() - self.started_cpu, 3),
+            "baseline_rss_bytes": self.baseline_rss,
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+
+class Stats:
+    def __init__(self):
+        self.ttft: List[float] = []
+        self.inter_token: List[float] = []
+        self.stream: List[float] = []
+        self.ok = 0
+        self.errors: Dict[str, int] = {}
+        self.frames = 0
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def consume(self, chunks, started: float) -> None:
+        """Time the content frames of one response body"""
+        last = None
+        failed = False
+        async for chunk in chunks:
+            now = time.perf_counter()
+            if b'"content"' in chunk:
+                self.frames += chunk.count(b"data: ")
+                if last is None:
+                    self.ttft.append(now - started)
+                else:
+                    self.inter_token.append(now - last)
+                last = now
+            if b'"error"' in chunk:
+                failed = True
+        if failed or last is None:
+            self.error("stream_error")
+        else:
+            self.ok += 1
+            self.stream.append(time.perf_counter() - started)
+
+
+async def http_client_task(client: httpx.AsyncClient, url: str, client_id: int, requests: int, stats: Stats) -> None:
+    for n in range(requests):
+        # Distinct messages so the response cache and coalescer don't short-circuit the stream
+        payload = {"message": f"benchmark client {client_id} request {n} {time.time_ns()}"}
+        started = time.perf_counter()
+        try:
+            async with client.stream("POST", url, json=payload) as response:
+                if response.status_code != 200:
+                    stats.error(f"http_{response.status_code}")
+                    await response.aread()
+                    continue
+                await stats.consume(response.aiter_raw(), started)
+        except httpx.HTTPError as e:
+            stats.error(type(e).__name__)
+
+
+async def run_http_level(target: str, concurrency: int, requests: int, timeout: float) -> Stats:
+    stats = Stats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout, pool=None)) as client:
+        url = f"{target.rstrip('/')}/api/chat"
+        await asyncio.gather(*(http_client_task(client, url, i, requests, stats) for i in range(concurrency)))
+    return stats
+
+
+async def run_direct_level(app, concurrency: int, requests: int) -> Stats:
+    """Drive stream_openrouter_response directly, leaving out HTTP, admission and caching"""
+    import chat
+
+    stats = Stats()
+
+    async def one(client_id: int) -> None:
+        for n in range(requests):
+            messages = [{"role": "user", "content": f"benchmark client {client_id} request {n}"}]
+            frames = chat.stream_openrouter_response(app.state.http_client, app.state.router, messages)
+            await stats.consume(frames, time.perf_counter())
+
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    return stats
+
+
+def summarize(stats: Stats, concurrency: int, duration: float, process: Optional[Dict[str, float]]) -> dict:
+    completed = stats.ok + sum(stats.errors.values())
+    result = {
+        "concurrency": concurrency,
+        "requests": completed,
+        "ok": stats.ok,
+        "errors": stats.errors,
+        "duration_s": round(duration, 3),
+        "requests_per_s": round(stats.ok / duration, 3) if duration else None,
+        "frames": stats.frames,
+        "ttft_ms": percentiles(stats.ttft),
+        "inter_token_ms": percentiles(stats.inter_token),
+        "stream_ms": percentiles(stats.stream),
+    }
+    if process is not None:
+        result.update(process)
+        result["cpu_ms_per_stream"] = round(process["cpu_seconds"] * 1000 / completed, 3) if completed else None
+        result["rss_bytes_per_stream"] = (process["peak_rss_bytes"] - process["baseline_rss_bytes"]) // concurrency
+    return result
+
+
+def raise_fd_limit() -> None:
+    """Each client needs a socket in this process and two in the server"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def git_commit() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def mock_command(args: argparse.Namespace) -> List[str]:
+    command = [sys.executable, os.path.join(HERE, "mock_upstream.py"), "--port", str(args.mock_port),
+               "--ttft", str(args.ttft), "--tokens", str(args.tokens), "--jitter", str(args.jitter),
+               "--error-rate", str(args.error_rate), "--drop-rate", str(args.drop_rate)]
+    if args.token_rate:
+        command += ["--token-rate", str(args.token_rate)]
+    return command
+
+
+def server_env(args: argparse.Namespace) -> Dict[str, str]:
+    """Settings that keep the server's own limits from being what the benchmark measures"""
+    peak = str(max(args.concurrency))
+    env = {
+        "UPSTREAMS": json.dumps([{"name": "mock", "base_url": f"http://127.0.0.1:{args.mock_port}/v1", "model": "mock"}]),
+        "RATE_LIMIT_RPS": "0",
+        "MAX_CONCURRENT_STREAMS": peak,
+        "MAX_QUEUED_STREAMS": peak,
+        "UPSTREAM_MAX_CONNECTIONS": peak,
+        "UPSTREAM_MAX_KEEPALIVE": peak,
+        "CACHE_BACKEND": "none",
+        "COALESCE_REQUESTS": "0",
+        "HEDGE_REQUESTS": "0",
+    }
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def run_levels(args: argparse.Namespace, target: Optional[str], pid: Optional[int], app=None) -> List[dict]:
+    results = []
+    for concurrency in args.concurrency:
+        sampler = ProcessSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+        started = time.perf_counter()
+        if app is not None:
+            stats = await run_direct_level(app, concurrency, args.requests)
+        else:
+            stats = await run_http_level(target, concurrency, args.requests, args.timeout)
+        duration = time.perf_counter() - started
+        result = summarize(stats, concurrency, duration, sampler.stop() if sampler else None)
+        results.append(result)
+        print(f"{concurrency:>6} clients: {result['requests_per_s']} req/s, "
+              f"TTFT p50 {result['ttft_ms']['p50']} ms / p99 {result['ttft_ms']['p99']} ms, "
+              f"inter-token p99 {result['inter_token_ms']['p99']} ms, errors {stats.errors or 0}", flush=True)
+    return results
+
+
+async def run_direct(args: argparse.Namespace) -> List[dict]:
+    # chat reads its settings at import time
+    os.environ.update(server_env(args))
+    import chat
+
+    app = chat.create_app()
+    async with chat.lifespan(app):
+        return await run_levels(args, None, os.getpid(), app)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the /api/chat streaming path against a local mock upstream")
+    parser.add_argument("--mode", choices=("http", "direct"), default="http",
+                        help="http: through a chat server process; direct: stream_openrouter_response in-process")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=1, help="sequential requests per client")
+    parser.add_argument("--target", help="benchmark this running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8700, help="port for the chat server started by the benchmark")
+    parser.add_argument("--mock-port", type=int, default=8701)
+    parser.add_argument("--ttft", type=float, default=0.2, help="mock time-to-first-token, seconds")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="mock tokens per second")
+    parser.add_argument("--tokens", type=int, default=100, help="mock tokens per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mock max extra random delay per token, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock fraction of failed requests")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="mock fraction of streams cut midway")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the chat server, e.g. FLUSH_INTERVAL_MS=0")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout, seconds")
+    parser.add_argument("--output", help="JSON report path (default: bench-<commit>-<mode>.json)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    raise_fd_limit()
+    processes: List[subprocess.Popen] = []
+    try:
+        if args.target:
+            results = asyncio.run(run_levels(args, args.target, None))
+        else:
+            processes.append(subprocess.Popen(mock_command(args), cwd=HERE))
+            wait_ready(f"http://127.0.0.1:{args.mock_port}/v1/models")
+            if args.mode == "direct":
+                results = asyncio.run(run_direct(args))
+            else:
+                server = subprocess.Popen(
+                    [sys.executable, os.path.join(HERE, "serve.py"), "--host", "127.0.0.1", "--port", str(args.port),
+                     "--workers", "1", "--log-level", "warning"],
+                    cwd=HERE, env={**os.environ, **server_env(args)},
+                )
+                processes.append(server)
+                target = f"http://127.0.0.1:{args.port}"
+                wait_ready(f"{target}/health")
+                results = asyncio.run(run_levels(args, target, server.pid))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        **git_commit(),
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "mode": "remote" if args.target else args.mode,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "requests_per_client": args.requests,
+        "mock": None if args.target else {
+            "ttft": args.ttft, "token_rate": args.token_rate, "tokens": args.tokens, "jitter": args.jitter,
+            "error_rate": args.error_rate, "drop_rate": args.drop_rate,
+        },
+        "server_env": None if args.target else {k: v for k, v in server_env(args).items() if k != "UPSTREAMS"},
+        "levels": results,
+    }
+    output = args.output or f"bench-{(report['commit'] or 'unknown')[:10]}-{report['mode']}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_message(message: str) -> str:
+    """Fold case, collapse whitespace and drop trailing punctuation so FAQ-style repeats share a key"""
+    message = re.sub(r"\s+", " ", message.strip().casefold())
+    return message.rstrip(" ?!.")
+
+
+def make_cache_key(model: str, system_prompt: str, temperature: float, max_tokens: int,
+                   message: str, normalize: bool = True) -> str:
+    """Hash everything that changes the upstream answer into a fixed-size key"""
+    if normalize:
+        message = normalize_message(message)
+    raw = json.dumps([model, system_prompt, temperature, max_tokens, message], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with a TTL, an entry limit and a byte budget"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value.decode("utf-8")
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        data = value.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, data)
+        self.size += len(data)
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.size -= len(value)
+
+    def close(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+class SQLiteCacheBackend:
+    """On-disk cache in a local SQLite file, evicting least recently used rows past the limits"""
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return row[0].decode("utf-8")
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        data = value.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl, now),
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            while count > self.max_entries or size > self.max_bytes:
+                oldest = self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access LIMIT 1"
+                ).fetchone()
+                if oldest is None:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (oldest[0],))
+                count -= 1
+                size -= oldest[1]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """Async front for a cache backend; blocking backends run in a worker thread"""
+
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.backend.get, key)
+        return self.backend.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.set, key, value, self.ttl)
+        else:
+            self.backend.set(key, value, self.ttl)
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+def create_response_cache(backend: str, ttl: float, max_entries: int, max_bytes: int,
+                          sqlite_path: str) -> Optional[ResponseCache]:
+    """Build the cache named by `backend` ("memory", "sqlite" or "none")"""
+    if backend == "memory":
+        return ResponseCache(MemoryCacheBackend(max_entries, max_bytes), ttl)
+    if backend == "sqlite":
+        return ResponseCache(SQLiteCacheBackend(sqlite_path, max_entries, max_bytes), ttl)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -1,861 +1,1125 @@
 import asyncio
 import json
+import logging
+import math
 import os
-from typing import AsyncGenerator
+import uuid
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
 import httpx
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import APIRouter, FastAPI, Request, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from starlette.requests import HTTPConnection
+
+from assets import AssetStore
+from images import CLIENT_HINTS, IMAGE_VARY
+from cache import ResponseCache, create_response_cache, make_cache_key
+from coalesce import StreamCoalescer
+from metrics import REGISTRY
+from conversation import ConversationStore, SQLiteConversationLog, build_context, estimate_tokens
+from jobs import Job, create_job_queue
+from replay import ReplayStore, ReplayStream, StreamGone, parse_last_event_id
+from semantic import create_semantic_cache
+from ratelimit import AdmissionController, MemoryBucketStore
+from sse import DecodeError, batch_tokens, encode_event, extract_content, extract_usage, idle_timeout, iter_sse_data
+from usage import SQLiteUsageLedger, Usage, UsageMeter, seconds_until
+from upstream import Upstream, UpstreamRouter, parse_upstreams
 
 # Set your OpenRouter API key
 OPENROUTER_API_KEY = "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"
 
-app = FastAPI(title="AI Chatbot", description="AI Chatbot powered by DeepSeek via OpenRouter")
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+MODEL = "deepseek/deepseek-chat"
+SYSTEM_PROMPT = "You are a helpful AI assistant. Provide clear, concise, and helpful responses. Format your responses nicely with proper spacing and structure when appropriate."
+TEMPERATURE = 0.7
+MAX_TOKENS = 2000
+
+# Upstream connection pool, shared by every chat stream for the lifetime of the app
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") == "1"
+UPSTREAM_WARMUP = os.getenv("UPSTREAM_WARMUP", "1") == "1"
+
+# Upstream routing: UPSTREAMS is a JSON list of {name, base_url, model, api_key, weight};
+# when unset, OpenRouter with MODEL is the only upstream
+UPSTREAMS = os.getenv("UPSTREAMS", "")
+UPSTREAM_EWMA_ALPHA = float(os.getenv("UPSTREAM_EWMA_ALPHA", "0.3"))
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "10"))
+# Status codes that mean the upstream itself is unavailable rather than the request being bad
+UPSTREAM_EJECT_STATUSES = {401, 403, 429}
+
+# Per-upstream circuit breaker, hedging of slow first tokens and retries before the first byte
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.2"))
+
+# Abort a stream when no token has arrived for this many seconds after the first one
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "20"))
+
+# Directory holding background.jpg (plus any variants pre-encoded by images.py) and favicon.ico;
+# loaded into memory at startup
+ASSET_DIR = os.getenv("ASSET_DIR", ".")
+# Page, stylesheet and script sources; minified and fingerprinted into memory at startup
+FRONTEND_DIR = os.getenv("FRONTEND_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend"))
+
+# Response cache for repeated prompts ("memory", "sqlite" or "none")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "response_cache.sqlite3")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_NORMALIZE = os.getenv("CACHE_NORMALIZE", "1") == "1"
+CACHE_REPLAY_CHUNK_CHARS = int(os.getenv("CACHE_REPLAY_CHUNK_CHARS", "0"))
+CACHE_REPLAY_DELAY = float(os.getenv("CACHE_REPLAY_DELAY", "0"))
+
+# Semantic cache: serve a cached answer to a paraphrase whose embedding is close enough. The
+# embedder is a sentence-transformers model name, "module:function" or "hashing" (no model, but only
+# near-verbatim repeats match; also the fallback when the model can't be loaded).
+# SEMANTIC_INDEX_PATH memory-maps the index so every worker shares it. Needs NumPy and a response cache.
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_EMBEDDER = os.getenv("SEMANTIC_EMBEDDER", "all-MiniLM-L6-v2")
+SEMANTIC_THRESHOLD = float(os.getenv("SEMANTIC_THRESHOLD", "0.9"))
+SEMANTIC_MAX_ENTRIES = int(os.getenv("SEMANTIC_MAX_ENTRIES", "10000"))
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH", "")
+
+# Merge identical in-flight prompts into one upstream stream
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+
+# Outgoing frame batching: after the first token, flush after N tokens, M bytes or T ms
+FLUSH_MAX_TOKENS = int(os.getenv("FLUSH_MAX_TOKENS", "16"))
+FLUSH_MAX_BYTES = int(os.getenv("FLUSH_MAX_BYTES", "1024"))
+FLUSH_INTERVAL_MS = float(os.getenv("FLUSH_INTERVAL_MS", "30"))
+
+# Server-side conversation memory (set CONVERSATION_SQLITE_PATH to persist turns)
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "50"))
+CONVERSATION_SQLITE_PATH = os.getenv("CONVERSATION_SQLITE_PATH", "")
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200"))
+
+# Per-client token buckets (RATE_LIMIT_RPS=0 disables) and a global cap on live streams
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "1"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Number of reverse proxies in front of the app that append to X-Forwarded-For (0 ignores the header)
+TRUST_PROXY_HEADERS = int(os.getenv("TRUST_PROXY_HEADERS", "0"))
+# Comma-separated API keys that get their own bucket and quota; any other X-API-Key is ignored
+API_KEYS = frozenset(key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip())
+MAX_CONCURRENT_STREAMS = int(os.getenv("MAX_CONCURRENT_STREAMS", "500"))
+MAX_QUEUED_STREAMS = int(os.getenv("MAX_QUEUED_STREAMS", "1000"))
+STREAM_QUEUE_TIMEOUT = float(os.getenv("STREAM_QUEUE_TIMEOUT", "5"))
+
+# Every /api/chat stream is buffered so a client can reconnect with Last-Event-ID. By default the
+# generation is cancelled as soon as the last reader leaves; RESUME_GRACE keeps it running that many
+# seconds longer so a dropped client can resume mid-answer, at the cost of generating for nobody.
+REPLAY_MAX_STREAMS = int(os.getenv("REPLAY_MAX_STREAMS", "2000"))
+REPLAY_MAX_FRAMES = int(os.getenv("REPLAY_MAX_FRAMES", "2048"))
+REPLAY_TTL = float(os.getenv("REPLAY_TTL", "120"))
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "0"))
+
+# Token accounting per client (API key or IP), from upstream usage fields or a local estimate.
+# Counters live in memory and are appended to the ledger in batches. Without a path (the default)
+# they are per process and lost on restart; set one (e.g. usage.sqlite3) to share quotas across workers.
+# Quotas count prompt + completion tokens per UTC day / month, 0 disables
+USAGE_SQLITE_PATH = os.getenv("USAGE_SQLITE_PATH", "")
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+QUOTA_DAILY_TOKENS = int(os.getenv("QUOTA_DAILY_TOKENS", "0"))
+QUOTA_MONTHLY_TOKENS = int(os.getenv("QUOTA_MONTHLY_TOKENS", "0"))
+
+# /ws/chat: concurrent generations one WebSocket connection may run at once
+WS_MAX_STREAMS = int(os.getenv("WS_MAX_STREAMS", "4"))
+
+# /api/chat/batch: most messages per request, and how many of them run at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Background generations behind /api/jobs ("memory" or "sqlite"; use sqlite with several workers)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+JOB_SQLITE_PATH = os.getenv("JOB_SQLITE_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "200"))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", "5000"))
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+JOB_CHECKPOINT_INTERVAL = float(os.getenv("JOB_CHECKPOINT_INTERVAL", "1.0"))
+
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, X-API-Key, Last-Event-ID",
+    "Access-Control-Expose-Headers": "X-Conversation-ID, X-Stream-ID"
+}
+
+logger = logging.getLogger("chat")
+
+TTFT_SECONDS = REGISTRY.histogram("chat_time_to_first_token_seconds", "Time from request to the first frame sent to the client")
+STREAM_SECONDS = REGISTRY.histogram("chat_stream_duration_seconds", "Time from request to the end of the response stream")
+INTER_TOKEN_SECONDS = REGISTRY.histogram("chat_inter_token_seconds", "Gap between consecutive frames sent to the client",
+                                         (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+TOKENS_TOTAL = REGISTRY.counter("chat_tokens_total", "Content deltas received from upstreams")
+BYTES_TOTAL = REGISTRY.counter("chat_bytes_streamed_total", "Response bytes streamed to clients")
+UPSTREAM_RESPONSES = REGISTRY.counter("upstream_responses_total", "Upstream responses by status code", ("upstream", "status"))
+UPSTREAM_TIMEOUTS = REGISTRY.counter("upstream_timeouts_total", "Upstream requests that timed out", ("upstream",))
+CLIENT_DISCONNECTS = REGISTRY.counter("chat_client_disconnects_total", "Streams abandoned by the client before completion")
+UPSTREAM_CANCELLATIONS = REGISTRY.counter("upstream_cancellations_total", "Upstream streams cancelled before completion")
+TOKENS_SAVED = REGISTRY.counter("upstream_tokens_saved_total", "Unused max_tokens budget of cancelled upstream streams (upper bound on tokens saved)")
+STREAM_RESUMES = REGISTRY.counter("chat_stream_resumes_total", "Reconnects served from the replay buffer")
+IDLE_ABORTS = REGISTRY.counter("upstream_idle_aborts_total", "Upstream streams aborted by the idle watchdog")
+USAGE_TOKENS = REGISTRY.counter("upstream_usage_tokens_total", "Tokens used by generations, by kind and whether the upstream reported them", ("kind", "source"))
+STREAMS_IN_FLIGHT = REGISTRY.gauge("chat_streams_in_flight", "Response streams currently open")
+POOL_CONNECTIONS = REGISTRY.gauge("upstream_pool_connections", "Connections held by the upstream pool")
+POOL_CONNECTIONS_ACTIVE = REGISTRY.gauge("upstream_pool_connections_active", "Upstream pool connections currently serving a request")
+
+
+def pool_connections(client: httpx.AsyncClient) -> list:
+    """Connections in the client's httpcore pool (empty if the transport doesn't expose one)"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []))
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled upstream client (HTTP/2 only when the h2 package is installed)"""
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def warm_up_client(client: httpx.AsyncClient, upstreams: List[Upstream]) -> None:
+    """Open a connection to each upstream so the first chat message skips DNS and TLS setup"""
+    async def warm_up(upstream: Upstream) -> None:
+        try:
+            await client.head(f"{upstream.base_url}/models", timeout=UPSTREAM_CONNECT_TIMEOUT)
+        except httpx.HTTPError as e:
+            logger.warning("Upstream warm-up failed for %s: %s", upstream.name, e)
+
+    await asyncio.gather(*(warm_up(upstream) for upstream in upstreams))
+
+
+def load_assets(directory: str, frontend_dir: str) -> AssetStore:
+    """Load images and the frontend bundle into memory; nothing is written to disk"""
+    assets = AssetStore()
+    assets.load_responsive(os.path.join(directory, "background.jpg"), "image/jpeg")
+    assets.load(os.path.join(directory, "favicon.ico"), "image/x-icon")
+    assets.load_frontend(frontend_dir)
+    return assets
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Reading files, and encoding image variants when they weren't pre-encoded, would block the loop
+    app.state.assets = await asyncio.to_thread(load_assets, ASSET_DIR, FRONTEND_DIR)
+    app.state.http_client = create_http_client()
+    app.state.router = UpstreamRouter(
+        parse_upstreams(UPSTREAMS, Upstream("openrouter", OPENROUTER_BASE_URL, MODEL, OPENROUTER_API_KEY)),
+        UPSTREAM_EWMA_ALPHA,
+        UPSTREAM_PROBE_INTERVAL,
+        CIRCUIT_FAILURE_THRESHOLD,
+        CIRCUIT_RESET_TIMEOUT,
+        HEDGE_PERCENTILE,
+        HEDGE_MIN_DELAY,
+        HEDGE_DEFAULT_DELAY,
+    )
+    health_checks = asyncio.create_task(app.state.router.run_health_checks(app.state.http_client))
+    app.state.usage = UsageMeter(
+        SQLiteUsageLedger(USAGE_SQLITE_PATH) if USAGE_SQLITE_PATH else None,
+        QUOTA_DAILY_TOKENS, QUOTA_MONTHLY_TOKENS, USAGE_FLUSH_INTERVAL
+    )
+    await app.state.usage.load()
+    usage_flusher = asyncio.create_task(app.state.usage.run_flusher())
+    POOL_CONNECTIONS.callback = lambda: len(pool_connections(app.state.http_client))
+    POOL_CONNECTIONS_ACTIVE.callback = lambda: sum(not c.is_idle() for c in pool_connections(app.state.http_client))
+    app.state.response_cache = create_response_cache(
+        CACHE_BACKEND, CACHE_TTL, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_SQLITE_PATH
+    )
+    # Loading (maybe downloading) the embedding model and probing it would block the loop
+    app.state.semantic_cache = await asyncio.to_thread(
+        create_semantic_cache,
+        SEMANTIC_CACHE and app.state.response_cache is not None,
+        SEMANTIC_EMBEDDER, SEMANTIC_THRESHOLD, SEMANTIC_MAX_ENTRIES, SEMANTIC_INDEX_PATH
+    )
+    app.state.coalescer = StreamCoalescer()
+    app.state.replays = ReplayStore(REPLAY_MAX_STREAMS, REPLAY_MAX_FRAMES, REPLAY_TTL, RESUME_GRACE)
+    app.state.rate_limiter = MemoryBucketStore(RATE_LIMIT_RPS, RATE_LIMIT_BURST) if RATE_LIMIT_RPS > 0 else None
+    app.state.admission = AdmissionController(MAX_CONCURRENT_STREAMS, MAX_QUEUED_STREAMS, STREAM_QUEUE_TIMEOUT)
+    conversation_log = None
+    if CONVERSATION_SQLITE_PATH:
+        conversation_log = SQLiteConversationLog(CONVERSATION_SQLITE_PATH, CONVERSATION_IDLE_TTL)
+    app.state.conversations = ConversationStore(
+        CONVERSATION_MAX_SESSIONS, CONVERSATION_IDLE_TTL, CONVERSATION_MAX_TURNS, conversation_log
+    )
+    app.state.jobs = create_job_queue(
+        JOB_BACKEND, lambda job: run_job(app, job), JOB_WORKERS, JOB_MAX_QUEUED,
+        JOB_MAX_STORED, JOB_TTL, JOB_SQLITE_PATH, JOB_CHECKPOINT_INTERVAL
+    )
+    if UPSTREAM_WARMUP:
+        await warm_up_client(app.state.http_client, app.state.router.upstreams)
+    try:
+        yield
+    finally:
+        health_checks.cancel()
+        usage_flusher.cancel()
+        await app.state.jobs.close()
+        await app.state.usage.close()
+        await app.state.http_client.aclose()
+        if app.state.response_cache is not None:
+            app.state.response_cache.close()
+        if app.state.semantic_cache is not None:
+            app.state.semantic_cache.close()
+        app.state.conversations.close()
+
+
+router = APIRouter()
 
 class ChatMessage(BaseModel):
     message: str
+    conversation_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     content: str
     error: str = None
+    conversation_id: Optional[str] = None
+
+class ChatBatchRequest(BaseModel):
+    messages: List[ChatMessage]
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatResponse]
+
+async def iter_content(response: httpx.Response, usage: Optional[Usage] = None) -> AsyncGenerator[str, None]:
+    """Yield the text deltas of an OpenAI-style streaming completion, noting its usage chunk in `usage`"""
+    chunks = response.aiter_bytes()
+    async for data in iter_sse_data(chunks):
+        try:
+            content = extract_content(data)
+            if usage is not None and b'"usage"' in data:
+                reported = extract_usage(data)
+                if reported is not None:
+                    usage.report(*reported)
+        except DecodeError:
+            continue
+        if content:
+            yield content
+    # Read on past [DONE] to the end of the body: HTTP/1.1 connections only go back to the pool once fully read
+    async for _ in chunks:
+        pass
+
+class UpstreamError(Exception):
+    """A failed upstream attempt; `retryable` means another attempt may succeed"""
+
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+async def iter_upstream_tokens(
+    client: httpx.AsyncClient,
+    router: UpstreamRouter,
+    upstream: Upstream,
+    payload: dict,
+    delay: float = 0.0,
+    usage: Optional[Usage] = None,
+) -> AsyncGenerator[str, None]:
+    """Stream one completion attempt from one upstream, reporting its latency and failures to the router"""
+    if delay:
+        await asyncio.sleep(delay)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first = True
+    upstream.inflight += 1
+    try:
+        async with client.stream(
+            "POST",
+            f"{upstream.base_url}/chat/completions",
+            headers=upstream.headers,
+            json={**payload, "model": upstream.model}
+        ) as response:
+            
+            UPSTREAM_RESPONSES.labels(upstream.name, response.status_code).inc()
+            if response.status_code != 200:
+                error_text = await response.aread()
+                unavailable = response.status_code >= 500 or response.status_code in UPSTREAM_EJECT_STATUSES
+                if unavailable:
+                    router.eject(upstream)
+                raise UpstreamError(f'API Error: {response.status_code} - {error_text.decode()}', unavailable)
+            
+            async for content in iter_content(response, usage):
+                if first:
+                    router.observe(upstream, loop.time() - started)
+                    first = False
+                TOKENS_TOTAL.value += 1
+                yield content
+                            
+    except httpx.TimeoutException:
+        UPSTREAM_TIMEOUTS.labels(upstream.name).inc()
+        router.eject(upstream)
+        raise UpstreamError('Request timeout. Please try again.', True)
+    except httpx.RequestError as e:
+        router.eject(upstream)
+        raise UpstreamError(f'Connection error: {str(e)}', True)
+    finally:
+        upstream.inflight -= 1
+
+async def stream_tokens(
+    client: httpx.AsyncClient,
+    router: UpstreamRouter,
+    payload: dict,
+    usage: Optional[Usage] = None,
+) -> AsyncGenerator[str, None]:
+    """Stream a completion, hedging a slow first token and retrying failures until the first token arrives
+
+    Attempts race for the first token; the winner is streamed and every other attempt is cancelled.
+    Once a token has been passed on, failures are no longer retried.
+    """
+    loop = asyncio.get_running_loop()
+    tried: List[Upstream] = []
+    attempts: Dict[asyncio.Future, Tuple[AsyncGenerator[str, None], Upstream]] = {}
+    retries = 0
+    hedged = not HEDGE_REQUESTS
+    hedge_at = 0.0
+    error: Optional[UpstreamError] = None
+
+    def launch() -> None:
+        nonlocal hedge_at
+        upstream = router.pick(exclude=tried)
+        # Back off only when going back to an upstream that already failed this request
+        delay = UPSTREAM_RETRY_BACKOFF * retries if upstream in tried else 0.0
+        tried.append(upstream)
+        hedge_at = loop.time() + delay + router.hedge_delay(upstream)
+        attempt = iter_upstream_tokens(client, router, upstream, payload, delay, usage)
+        attempts[asyncio.ensure_future(attempt.__anext__())] = (attempt, upstream)
+
+    launch()
+    winner = None
+    winner_upstream = None
+    first = None
+    try:
+        while winner is None:
+            if not attempts:
+                raise error
+            timeout = None if hedged else max(hedge_at - loop.time(), 0)
+            done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                # Hedging on an upstream already in the race doubles the cost without cutting the tail
+                if router.has_alternative(tried):
+                    launch()
+                continue
+            for future in done:
+                attempt, upstream = attempts.pop(future)
+                try:
+                    token = future.result()
+                except StopAsyncIteration:
+                    return
+                except UpstreamError as e:
+                    error = e
+                    if e.retryable and retries < UPSTREAM_MAX_RETRIES and not attempts:
+                        retries += 1
+                        launch()
+                    continue
+                if winner is None:
+                    winner, winner_upstream, first = attempt, upstream, token
+                else:
+                    await attempt.aclose()
+    finally:
+        for future in attempts:
+            future.cancel()
 
-async def stream_openrouter_response(message: str) -> AsyncGenerator[str, None]:
-    """Stream response from OpenRouter API"""
-    
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "AI Chatbot"
-    }
-    
-    payload = {
-        "model": "deepseek/deepseek-chat",
-        "messages": [
-            {
-                "role": "system", 
-                "content": "You are a helpful AI assistant. Provide clear, concise, and helpful responses. Format your responses nicely with proper spacing and structure when appropriate."
-            },
-            {"role": "user", "content": message}
-        ],
+    try:
+        yield first
+        async for content in idle_timeout(winner, STREAM_IDLE_TIMEOUT):
+            yield content
+    except TimeoutError:
+        IDLE_ABORTS.inc()
+        router.eject(winner_upstream)
+        raise UpstreamError('The response stalled. Please try again.', False)
+    finally:
+        await winner.aclose()
+
+def build_payload(messages: List[Dict[str, str]]) -> Dict:
+    # No model here: each upstream fills in its own
+    return {
+        "messages": [{"role": "system", "content": SYSTEM_PROMPT}, *messages],
         "stream": True,
-        "temperature": 0.7,
-        "max_tokens": 2000
+        "stream_options": {"include_usage": True},
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS
     }
+
+def report_usage(on_usage: Optional[Callable[[Usage], None]], usage: Usage, payload: dict, parts: List[str]) -> None:
+    """Count a generation's usage once and pass it on, estimating whatever the upstream didn't report"""
+    # Nothing was generated (and nothing reported) when every attempt failed up front
+    if not parts and usage.prompt_tokens is None:
+        return
+    usage.settle(payload["messages"], "".join(parts))
+    source = "estimated" if usage.estimated else "reported"
+    USAGE_TOKENS.labels("prompt", source).inc(usage.prompt_tokens)
+    USAGE_TOKENS.labels("completion", source).inc(usage.completion_tokens)
+    if on_usage is not None:
+        on_usage(usage)
+
+async def complete_openrouter_response(
+    client: httpx.AsyncClient,
+    router: UpstreamRouter,
+    messages: List[Dict[str, str]],
+    on_usage: Optional[Callable[[Usage], None]] = None,
+) -> str:
+    """Collect a whole answer for callers that don't want a stream; raises UpstreamError on failure
+
+    The upstream request still streams, so routing, hedging and retries work exactly as for /api/chat.
+    """
+    payload = build_payload(messages)
+    usage = Usage()
+    parts = []
+    try:
+        async for token in stream_tokens(client, router, payload, usage):
+            parts.append(token)
+    finally:
+        report_usage(on_usage, usage, payload, parts)
+    return "".join(parts)
+
+async def stream_openrouter_response(
+    client: httpx.AsyncClient,
+    router: UpstreamRouter,
+    messages: List[Dict[str, str]],
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+    on_usage: Optional[Callable[[Usage], None]] = None,
+) -> AsyncGenerator[bytes, None]:
+    """Stream response from the fastest healthy upstream, passing the full answer to on_complete if it finishes cleanly
+
+    on_usage gets the generation's token usage however it ends, including when it is cancelled.
+    """
+    
+    payload = build_payload(messages)
+    usage = Usage()
+    parts = []
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            async with client.stream(
-                "POST",
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                
-                if response.status_code != 200:
-                    error_text = await response.aread()
-                    yield f"data: {json.dumps({'error': f'API Error: {response.status_code} - {error_text.decode()}'})}\n\n"
-                    return
-                
-                async for chunk in response.aiter_lines():
-                    if chunk:
-                        chunk = chunk.strip()
-                        if chunk.startswith(b"data: "):
-                            data_str = chunk[6:].decode('utf-8')
-                            
-                            if data_str == "[DONE]":
-                                break
-                                
-                            try:
-                                data = json.loads(data_str)
-                                if "choices" in data and len(data["choices"]) > 0:
-                                    delta = data["choices"][0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        yield f"data: {json.dumps({'content': content})}\n\n"
-                            except json.JSONDecodeError:
-                                continue
-                                
-    except httpx.TimeoutException:
-        yield f"data: {json.dumps({'error': 'Request timeout. Please try again.'})}\n\n"
-    except httpx.RequestError as e:
-        yield f"data: {json.dumps({'error': f'Connection error: {str(e)}'})}\n\n"
+        tokens = batch_tokens(stream_tokens(client, router, payload, usage), FLUSH_MAX_TOKENS, FLUSH_MAX_BYTES, FLUSH_INTERVAL_MS / 1000)
+        async for content in tokens:
+            parts.append(content)
+            yield encode_event({'content': content})
+    except UpstreamError as e:
+        yield encode_event({'error': str(e)})
+        return
+    except (asyncio.CancelledError, GeneratorExit):
+        UPSTREAM_CANCELLATIONS.inc()
+        TOKENS_SAVED.inc(max(0, MAX_TOKENS - estimate_tokens("".join(parts))))
+        raise
     except Exception as e:
-        yield f"data: {json.dumps({'error': f'Unexpected error: {str(e)}'})}\n\n"
-
-@app.post("/api/chat")
-async def chat_endpoint(chat_message: ChatMessage):
-    """Handle chat messages and return streaming response"""
+        yield encode_event({'error': f'Unexpected error: {str(e)}'})
+        return
+    finally:
+        report_usage(on_usage, usage, payload, parts)
+
+    if on_complete is not None and parts:
+        await on_complete("".join(parts))
+
+async def wait_for_disconnect(request: Request) -> None:
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def track_stream(
+    frames: AsyncGenerator[bytes, None],
+    request: Optional[Request],
+    started: float,
+) -> AsyncGenerator[bytes, None]:
+    """Stream frames to the client, stopping as soon as it disconnects
+
+    Records latency and volume metrics.
+    A disconnect while waiting for a frame cancels that wait and closes this reader; the generation
+    itself is cancelled, closing the upstream request, once no reader is left for RESUME_GRACE seconds.
+    Without a request (e.g. on a WebSocket) the caller watches for disconnects and cancels the task itself.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    last = 0.0
+    reading = True
+    disconnected = False
+
+    def on_disconnect(watcher: asyncio.Future) -> None:
+        nonlocal disconnected
+        if watcher.cancelled() or watcher.exception() is not None:
+            return
+        disconnected = True
+        # While the frame is being sent the send itself fails; only interrupt our own wait
+        if reading:
+            task.cancel()
+
+    watcher = asyncio.ensure_future(wait_for_disconnect(request)) if request is not None else None
+    if watcher is not None:
+        watcher.add_done_callback(on_disconnect)
+    completed = False
+    STREAMS_IN_FLIGHT.inc()
+    try:
+        async for frame in frames:
+            reading = False
+            now = loop.time()
+            if last:
+                INTER_TOKEN_SECONDS.observe(now - last)
+            else:
+                TTFT_SECONDS.observe(now - started)
+            last = now
+            BYTES_TOTAL.value += len(frame)
+            yield frame
+            if disconnected:
+                break
+            reading = True
+        else:
+            completed = True
+            STREAM_SECONDS.observe(loop.time() - started)
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        task.uncancel()
+    finally:
+        reading = False
+        if watcher is not None:
+            watcher.cancel()
+        if not completed:
+            CLIENT_DISCONNECTS.inc()
+        await frames.aclose()
+        STREAMS_IN_FLIGHT.dec()
+
+def client_id(request: HTTPConnection) -> str:
+    """Identify the caller by API key when it is one of API_KEYS, otherwise by IP address
+
+    An unrecognised key falls through to the IP, so rotating made-up keys can't mint fresh buckets.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in API_KEYS:
+        return f"key:{api_key}"
+    if TRUST_PROXY_HEADERS:
+        # Entries left of what our own proxies appended were written by the client, so can't be trusted
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",")]
+        if len(forwarded) >= TRUST_PROXY_HEADERS and forwarded[-TRUST_PROXY_HEADERS]:
+            return f"ip:{forwarded[-TRUST_PROXY_HEADERS]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+async def replay_cached_response(text: str) -> AsyncGenerator[bytes, None]:
+    """Replay a cached answer with the same SSE framing as a live stream"""
+    size = CACHE_REPLAY_CHUNK_CHARS or len(text)
+    for start in range(0, len(text), size):
+        if start and CACHE_REPLAY_DELAY:
+            await asyncio.sleep(CACHE_REPLAY_DELAY)
+        yield encode_event({'content': text[start:start + size]})
+
+async def cached_answer(app: FastAPI, cache: ResponseCache, key: str, message: str) -> Tuple[Optional[str], str]:
+    """Exact match first, then the closest paraphrase; returns (answer, X-Cache value)"""
+    text = await cache.get(key)
+    if text is not None:
+        return text, "HIT"
+    semantic = app.state.semantic_cache
+    if semantic is not None:
+        similar = await semantic.lookup(message)
+        if similar is not None and similar != key:
+            text = await cache.get(similar)
+            if text is not None:
+                return text, "SEMANTIC"
+    return None, "MISS"
+
+async def store_answer(app: FastAPI, cache: ResponseCache, key: str, message: str, text: str) -> None:
+    await cache.set(key, text)
+    if app.state.semantic_cache is not None:
+        await app.state.semantic_cache.add(message, key)
+
+class ChatTurn:
+    """One message in a conversation: the context sent upstream, its cache entry and its place in the history
+
+    Shared by streamed, non-streamed and background answers so they cache and record turns alike.
+    """
+
+    def __init__(self, app: FastAPI, message: str, conversation_id: str, history: List[Dict[str, str]]):
+        self.app = app
+        self.message = message
+        self.conversation_id = conversation_id
+        self.messages = build_context(history, message, CONTEXT_MAX_TOKENS, CONTEXT_SUMMARY_TOKENS)
+        # Only a conversation's first turn depends on the message alone, so only it is cached or shared
+        self.shareable = not history
+        self.key = make_cache_key(MODEL, SYSTEM_PROMPT, TEMPERATURE, MAX_TOKENS, message, CACHE_NORMALIZE)
+        self.cache: Optional[ResponseCache] = app.state.response_cache if self.shareable else None
+
+    async def cached(self) -> Tuple[Optional[str], Optional[str]]:
+        """(answer, X-Cache value); the value is None when this turn can't be cached"""
+        if self.cache is None:
+            return None, None
+        return await cached_answer(self.app, self.cache, self.key, self.message)
+
+    async def store(self, text: str) -> None:
+        if self.cache is not None:
+            await store_answer(self.app, self.cache, self.key, self.message, text)
+
+    async def record(self, text: str) -> None:
+        await self.app.state.conversations.append(
+            self.conversation_id,
+            {"role": "user", "content": self.message},
+            {"role": "assistant", "content": text},
+        )
+
+async def prepare_turn(app: FastAPI, message: str, conversation_id: str) -> ChatTurn:
+    return ChatTurn(app, message, conversation_id, await app.state.conversations.history(conversation_id))
+
+def check_rate_limit(request: HTTPConnection, cost: int = 1) -> None:
+    """Charge the caller cost tokens, one per generation the request starts"""
+    rate_limiter = request.app.state.rate_limiter
+    if rate_limiter is not None:
+        retry_after = rate_limiter.take(client_id(request), cost)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please slow down.",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+def check_quota(request: HTTPConnection) -> None:
+    """Refuse callers over their token quota; an in-memory lookup, no database on the request path"""
+    period = request.app.state.usage.exceeded(client_id(request))
+    if period is not None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Token quota for this {period} exceeded.",
+            headers={"Retry-After": str(seconds_until(period))}
+        )
+
+def usage_recorder(app: FastAPI, client: str) -> Callable[[Usage], None]:
+    """Charge a client for a generation; every subscriber of a coalesced stream gets one of these"""
+    meter = app.state.usage
+
+    def record(usage: Usage) -> None:
+        meter.record(client, usage)
+
+    return record
+
+async def answer_message(chat_message: ChatMessage, request: Request) -> Tuple[ChatResponse, int]:
+    """Answer one message in full, with the same history, caching and admission as a stream; returns (response, status)"""
+    conversation_id = chat_message.conversation_id or uuid.uuid4().hex
+    if not chat_message.message.strip():
+        return ChatResponse(content="", error="Message cannot be empty", conversation_id=conversation_id), 400
+
+    turn = await prepare_turn(request.app, chat_message.message, conversation_id)
+    content, _ = await turn.cached()
+    if content is None:
+        admission = request.app.state.admission
+        if not await admission.acquire():
+            return ChatResponse(content="", error="Server is busy. Please try again shortly.",
+                                conversation_id=conversation_id), 503
+        try:
+            content = await complete_openrouter_response(
+                request.app.state.http_client, request.app.state.router, turn.messages,
+                usage_recorder(request.app, client_id(request))
+            )
+        except UpstreamError as e:
+            return ChatResponse(content="", error=str(e), conversation_id=conversation_id), 502
+        except Exception as e:
+            logger.exception("Non-streaming chat failed")
+            return ChatResponse(content="", error=f"Unexpected error: {str(e)}", conversation_id=conversation_id), 500
+        finally:
+            admission.release()
+        await turn.store(content)
+
+    await turn.record(content)
+    return ChatResponse(content=content, conversation_id=conversation_id), 200
+
+async def open_chat_stream(
+    chat_message: ChatMessage,
+    request: HTTPConnection,
+) -> Tuple[ReplayStream, Dict[str, str]]:
+    """Start answering a message as a resumable stream; raises HTTPException when it can't be admitted
+
+    Returns the stream and its response headers. A new upstream generation holds an admission slot
+    until it finishes, which may be after its last reader has gone (see RESUME_GRACE); joining one
+    that is already running doesn't take a slot.
+    """
+    conversation_id = chat_message.conversation_id or uuid.uuid4().hex
+    turn = await prepare_turn(request.app, chat_message.message, conversation_id)
+    headers = {**STREAM_HEADERS, "X-Conversation-ID": conversation_id}
+
+    cached, status = await turn.cached()
+    if status is not None:
+        headers["X-Cache"] = status
+    if cached is not None:
+        await turn.record(cached)
+        replay = request.app.state.replays.start(replay_cached_response(cached))
+        headers["X-Stream-ID"] = replay.id
+        return replay, headers
     
+    coalescer = request.app.state.coalescer
+    coalesce = COALESCE_REQUESTS and turn.shareable
+    # Joining a stream that is already running costs nothing upstream, so it doesn't need a slot
+    admission = None if coalesce and turn.key in coalescer else request.app.state.admission
+    if admission is not None and not await admission.acquire():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(STREAM_QUEUE_TIMEOUT))}
+        )
+    
+    def start_stream(on_complete, on_usage):
+        async def finish(text: str) -> None:
+            await turn.store(text)
+            await on_complete(text)
+
+        return stream_openrouter_response(request.app.state.http_client, request.app.state.router, turn.messages,
+                                          finish, on_usage)
+
+    on_usage = usage_recorder(request.app, client_id(request))
+    if coalesce:
+        frames = coalescer.subscribe(turn.key, start_stream, turn.record, on_usage)
+    else:
+        frames = start_stream(turn.record, on_usage)
+
+    replay = request.app.state.replays.start(frames, admission.release if admission is not None else None)
+    headers["X-Stream-ID"] = replay.id
+    return replay, headers
+
+@router.post("/api/chat")
+async def chat_endpoint(chat_message: ChatMessage, request: Request, stream: bool = True):
+    """Handle chat messages and return streaming response, or a ChatResponse with ?stream=false"""
+    
+    started = asyncio.get_running_loop().time()
     if not chat_message.message.strip():
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     
+    check_rate_limit(request)
+    check_quota(request)
+    if not stream:
+        result, status = await answer_message(chat_message, request)
+        headers = {"X-Conversation-ID": result.conversation_id}
+        return JSONResponse(jsonable_encoder(result), status_code=status, headers=headers)
+    
+    replay, headers = await open_chat_stream(chat_message, request)
     return StreamingResponse(
-        stream_openrouter_response(chat_message.message),
+        track_stream(replay.follow(), request, started),
         media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type"
-        }
+        headers=headers
     )
 
-@app.get("/")
-async def serve_index():
+@router.get("/api/chat/stream/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, last_event_id: Optional[str] = None):
+    """Resume a chat stream after the frame named by the Last-Event-ID header (or ?last_event_id=)"""
+    replay = request.app.state.replays.get(stream_id)
+    if replay is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    after = parse_last_event_id(request.headers.get("last-event-id") or last_event_id, stream_id)
+    try:
+        replay.check(after)
+    except StreamGone:
+        raise HTTPException(status_code=409, detail="Stream can no longer be resumed from that point")
+    STREAM_RESUMES.inc()
+    return StreamingResponse(replay.follow(after), media_type="text/plain", headers={**STREAM_HEADERS, "X-Stream-ID": stream_id})
+
+@router.post("/api/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_endpoint(batch: ChatBatchRequest, request: Request):
+    """Answer many messages concurrently; results come back in order, each with its own error"""
+    if not batch.messages:
+        raise HTTPException(status_code=400, detail="Batch cannot be empty")
+    if len(batch.messages) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch cannot exceed {BATCH_MAX_ITEMS} messages")
+    check_rate_limit(request, len(batch.messages))
+    check_quota(request)
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(chat_message: ChatMessage) -> ChatResponse:
+        async with semaphore:
+            try:
+                result, _ = await answer_message(chat_message, request)
+            except Exception as e:
+                # e.g. the conversation log or cache failing; only this item fails, not the batch
+                logger.exception("Batch chat item failed")
+                return ChatResponse(content="", error=f"Unexpected error: {str(e)}",
+                                    conversation_id=chat_message.conversation_id)
+            return result
+
+    return ChatBatchResponse(results=await asyncio.gather(*(run(m) for m in batch.messages)))
+
+class SocketClosed(Exception):
+    """A send on a WebSocket that is closing or already closed"""
+
+class ChatSocket:
+    """One /ws/chat connection and the streams running on it, keyed by the client's request IDs"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.streams: Dict[str, asyncio.Task] = {}
+        self.cancelled: set = set()
+        # Streams take turns on the socket in FIFO order. Each send waits for the transport to
+        # drain, so a slow reader holds back the streams feeding it instead of piling frames up here.
+        self._send_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def _sending(self):
+        async with self._send_lock:
+            try:
+                yield
+            except (WebSocketDisconnect, RuntimeError) as e:
+                # Starlette raises RuntimeError for a send after the close, WebSocketDisconnect mid-send
+                raise SocketClosed() from e
+
+    async def send_control(self, **message) -> None:
+        async with self._sending():
+            await self.websocket.send_text(json.dumps(message))
+
+    async def send_frames(self, request_id: str, frames: bytes) -> None:
+        # The same SSE frames /api/chat sends, after a line naming the request they belong to
+        async with self._sending():
+            await self.websocket.send_bytes(request_id.encode("utf-8") + b"\n" + frames)
+
+    def cancel(self, request_id: str) -> None:
+        task = self.streams.get(request_id)
+        if task is not None:
+            self.cancelled.add(request_id)
+            task.cancel()
+
+    async def close(self) -> None:
+        for task in self.streams.values():
+            task.cancel()
+        await asyncio.gather(*self.streams.values(), return_exceptions=True)
+
+async def run_socket_stream(socket: ChatSocket, request_id: str, chat_message: ChatMessage) -> None:
+    """Answer one message on a WebSocket: a start message, binary frames, then done (or an error)"""
+    websocket = socket.websocket
+    started = asyncio.get_running_loop().time()
+    replay = None
+    frames = None
+    try:
+        if not chat_message.message.strip():
+            raise HTTPException(status_code=400, detail="Message cannot be empty")
+        check_rate_limit(websocket)
+        check_quota(websocket)
+        replay, headers = await open_chat_stream(chat_message, websocket)
+        frames = track_stream(replay.follow(), None, started)
+        await socket.send_control(type="start", id=request_id, conversation_id=headers["X-Conversation-ID"],
+                                  stream_id=replay.id, cache=headers.get("X-Cache"))
+        async for chunk in frames:
+            await socket.send_frames(request_id, chunk)
+        await socket.send_control(type="done", id=request_id)
+    except SocketClosed:
+        # The connection closed under us; chat_websocket is cancelling everything else
+        pass
+    except HTTPException as e:
+        retry_after = (e.headers or {}).get("Retry-After")
+        with suppress(SocketClosed):
+            await socket.send_control(type="error", id=request_id, status=e.status_code, detail=e.detail,
+                                      retry_after=int(retry_after) if retry_after else None)
+    except asyncio.CancelledError:
+        if request_id not in socket.cancelled:
+            raise
+        # Cancelled by the client: stop the generation now rather than keeping it for a resume
+        if replay is not None:
+            replay.task.cancel()
+        with suppress(SocketClosed):
+            await socket.send_control(type="done", id=request_id, cancelled=True)
+    except Exception:
+        logger.exception("WebSocket chat stream failed")
+        with suppress(SocketClosed):
+            await socket.send_control(type="error", id=request_id, status=500, detail="Internal server error")
+    finally:
+        if frames is not None:
+            await frames.aclose()
+        socket.streams.pop(request_id, None)
+        socket.cancelled.discard(request_id)
+
+@router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """Run several chat streams at once over one connection
+
+    The client sends JSON text messages: {"type": "chat", "id", "message", "conversation_id"} starts a
+    stream and {"type": "cancel", "id"} stops one. Control messages come back as JSON text
+    ({"type": "start" | "done" | "error", "id", ...}); stream content comes as binary messages.
+    """
+    await websocket.accept()
+    socket = ChatSocket(websocket)
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                command = json.loads(message.get("text") or "")
+                request_id = str(command["id"])
+                kind = command.get("type")
+            except (ValueError, TypeError, KeyError):
+                await socket.send_control(type="error", id=None, status=400, detail="Expected a JSON object with an id")
+                continue
+
+            if kind == "cancel":
+                socket.cancel(request_id)
+            elif kind == "chat":
+                if request_id in socket.streams:
+                    await socket.send_control(type="error", id=request_id, status=409, detail="Request ID already in use")
+                    continue
+                if len(socket.streams) >= WS_MAX_STREAMS:
+                    await socket.send_control(type="error", id=request_id, status=429,
+                                              detail=f"At most {WS_MAX_STREAMS} concurrent streams per connection")
+                    continue
+                try:
+                    chat_message = ChatMessage(message=command.get("message"), conversation_id=command.get("conversation_id"))
+                except ValidationError:
+                    await socket.send_control(type="error", id=request_id, status=422, detail="Invalid chat message")
+                    continue
+                socket.streams[request_id] = asyncio.create_task(run_socket_stream(socket, request_id, chat_message))
+            else:
+                await socket.send_control(type="error", id=request_id, status=400, detail=f"Unknown message type: {kind}")
+    except (WebSocketDisconnect, SocketClosed):
+        pass
+    finally:
+        await socket.close()
+
+async def run_job(app: FastAPI, job: Job) -> AsyncGenerator[str, None]:
+    """Generate a job's answer token by token, with the same history and caching as /api/chat"""
+    turn = await prepare_turn(app, job.message, job.conversation_id)
+    content, _ = await turn.cached()
+    if content is not None:
+        yield content
+    else:
+        payload = build_payload(turn.messages)
+        usage = Usage()
+        parts = []
+        try:
+            async for token in stream_tokens(app.state.http_client, app.state.router, payload, usage):
+                parts.append(token)
+                yield token
+        finally:
+            report_usage(usage_recorder(app, job.owner), usage, payload, parts)
+        content = "".join(parts)
+        await turn.store(content)
+    await turn.record(content)
+
+async def follow_job(request: Request, job: Job, offset: int) -> AsyncGenerator[bytes, None]:
+    """Stream a job's tokens from offset until it finishes; each frame carries the offset to resume from"""
+    jobs = request.app.state.jobs
+    while True:
+        if offset < len(job.tokens):
+            yield encode_event({'content': "".join(job.tokens[offset:]), 'offset': len(job.tokens)})
+            offset = len(job.tokens)
+        if job.finished:
+            if job.error:
+                yield encode_event({'error': job.error})
+            return
+        job = await jobs.wait(job, STREAM_IDLE_TIMEOUT)
+
+@router.post("/api/jobs")
+async def create_job(chat_message: ChatMessage, request: Request):
+    """Start a generation in the background and return its ID right away"""
+    if not chat_message.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    check_rate_limit(request)
+    check_quota(request)
+    job = Job(chat_message.message, chat_message.conversation_id or uuid.uuid4().hex)
+    job.owner = client_id(request)
+    if not await request.app.state.jobs.submit(job):
+        raise HTTPException(
+            status_code=503,
+            detail="Too many jobs queued. Please try again shortly.",
+            headers={"Retry-After": str(math.ceil(STREAM_QUEUE_TIMEOUT))}
+        )
+    return JSONResponse(job.to_dict(), status_code=202, headers={"Location": f"/api/jobs/{job.id}"})
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, offset: int = 0):
+    """Poll a job; content holds the tokens from offset on, and offset in the reply is where to continue"""
+    job = await request.app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict(max(0, offset))
+
+@router.get("/api/jobs/{job_id}/stream")
+async def stream_job(job_id: str, request: Request, offset: int = 0):
+    """Stream a job from a token offset, so a dropped client can resume without a new generation"""
+    job = await request.app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(follow_job(request, job, max(0, offset)), media_type="text/plain", headers=STREAM_HEADERS)
+
+@router.api_route("/", methods=["GET", "HEAD"])
+async def serve_index(request: Request) -> Response:
     """Serve the main HTML file"""
-    return FileResponse("index.html", media_type="text/html")
+    assets = request.app.state.assets
+    response = assets.response(request, assets.assets.get("index.html"))
+    # Ask for the viewport size on later requests, so the background can be sized to the screen
+    response.headers["Accept-CH"] = CLIENT_HINTS
+    return response
+
+@router.api_route("/sw.js", methods=["GET", "HEAD"])
+async def serve_service_worker(request: Request) -> Response:
+    """Serve the service worker from the root so its scope covers the whole app; browsers revalidate it on every visit"""
+    assets = request.app.state.assets
+    return assets.response(request, assets.assets.get("sw.js"))
+
+@router.api_route("/background.jpg", methods=["GET", "HEAD"])
+async def serve_background(request: Request) -> Response:
+    """Serve the background image, resized and re-encoded for the requesting device when variants exist"""
+    assets = request.app.state.assets
+    image = assets.responsive.get("background.jpg")
+    if image is None:
+        return assets.response(request, None)
+    return assets.response(request, image.choose(request), vary=IMAGE_VARY if image.variants else None)
+
+@router.api_route("/favicon.ico", methods=["GET", "HEAD"])
+async def serve_favicon(request: Request) -> Response:
+    """Serve the favicon"""
+    assets = request.app.state.assets
+    return assets.response(request, assets.assets.get("favicon.ico"))
 
-@app.get("/background.jpg")
-async def serve_background():
-    """Serve the background image"""
-    return FileResponse("background.jpg", media_type="image/jpeg")
+@router.api_route("/assets/{name}", methods=["GET", "HEAD"])
+async def serve_fingerprinted_asset(name: str, request: Request) -> Response:
+    """Serve a content-addressed asset; its URL changes whenever it does, so it can be cached forever"""
+    assets = request.app.state.assets
+    return assets.response(request, assets.fingerprinted.get(name), immutable=True)
 
-@app.get("/favicon.ico")
-async def serve_favicon():
-    """Serve the favicon"""
-    return FileResponse("favicon.ico", media_type="image/x-icon")
+@router.get("/api/usage")
+async def get_usage(request: Request):
+    """The caller's token usage for the current day and month, and its quotas"""
+    return request.app.state.usage.summary(client_id(request))
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 # Health check endpoint for deployment
-@app.get("/health")
+@router.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "AI Chatbot"}
 
+
+def create_app() -> FastAPI:
+    """Build the application; also usable as `uvicorn --factory chat:create_app`"""
+    app = FastAPI(title="AI Chatbot", description="AI Chatbot powered by DeepSeek via OpenRouter", lifespan=lifespan)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
+
 if __name__ == "__main__":
-    import uvicorn
-    
-    # Create the HTML file
-    html_content = '''<!DOCTYPE html>
-<html lang="en">
-
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <meta name="description" content="AI Chatbot powered by DeepSeek via OpenRouter">
-    <title>AI Chatbot</title>
-    <link rel="icon" type="image/x-icon"
-        href="data:image/svg+xml,<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 100 100'><text y='.9em' font-size='90'>🤖</text></svg>">
-    <meta name="theme-color" content="#007AFF">
-    <meta name="mobile-web-app-capable" content="yes">
-    <meta name="apple-mobile-web-app-capable" content="yes">
-    <meta name="apple-mobile-web-app-status-bar-style" content="black-translucent">
-    <meta name="apple-mobile-web-app-title" content="AI Chatbot">
-    <style>
-        :root {
-            --primary-color: #007AFF;
-            --primary-color-dark: rgba(0, 86, 204, 0.8);
-            --bg-message-user: rgba(0, 122, 255, 0.7);
-            --bg-message-bot: rgba(255, 255, 255, 0.15);
-            --text-color: white;
-            --border-color: rgba(255, 255, 255, 0.2);
-            --error-color: rgba(255, 59, 48, 0.9);
-        }
-
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-            background: #000;
-            height: 100vh;
-            height: calc(var(--vh, 1vh) * 100);
-            margin: 0;
-            padding: 0;
-            display: flex;
-            flex-direction: column;
-            color: var(--text-color);
-            overflow: hidden;
-            position: relative;
-        }
-
-        body::before {
-            content: '';
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: url('background.jpg') center/cover no-repeat;
-            z-index: -2;
-            opacity: 0.6;
-        }
-
-        body::after {
-            content: '';
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: linear-gradient(to bottom, rgba(0, 0, 0, 0.6), rgba(0, 0, 0, 0.5));
-            z-index: -1;
-        }
-
-        .chat-container {
-            width: 100%;
-            height: 100vh;
-            height: calc(var(--vh, 1vh) * 100);
-            display: flex;
-            flex-direction: column;
-            overflow: hidden;
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            max-width: 800px;
-            margin: 0 auto;
-            justify-content: flex-end;
-            background: transparent;
-        }
-
-        .chat-header {
-            padding: 15px 20px;
-            text-align: center;
-            border-bottom: none;
-            flex-shrink: 0;
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            z-index: 1000;
-            max-width: 800px;
-            margin: 0 auto;
-            background: rgba(0, 0, 0, 0.3);
-            backdrop-filter: blur(5px);
-            width: 100%;
-        }
-
-        .chat-header h1 {
-            color: var(--text-color);
-            font-size: 1.5rem;
-            font-weight: 600;
-            margin-bottom: 5px;
-            text-shadow: 0 2px 4px rgba(0, 0, 0, 0.3);
-        }
-
-        .chat-header p {
-            color: rgba(255, 255, 255, 0.9);
-            font-size: 0.9rem;
-            text-shadow: 0 1px 2px rgba(0, 0, 0, 0.3);
-        }
-
-        .chat-messages {
-            flex: 1;
-            overflow-y: auto;
-            padding: 20px;
-            padding-top: 100px;
-            padding-bottom: 100px;
-            display: flex;
-            flex-direction: column;
-            gap: 12px;
-            width: 100%;
-            scroll-behavior: smooth;
-            position: relative;
-            background: transparent;
-        }
-
-        .message {
-            max-width: 85%;
-            padding: 12px 16px;
-            border-radius: 18px;
-            word-wrap: break-word;
-            animation: slideIn 0.15s ease-out;
-            line-height: 1.5;
-            border: none;
-        }
-
-        .user-message {
-            background: rgba(0, 122, 255, 0.4);
-            color: var(--text-color);
-            border-bottom-right-radius: 4px;
-            margin-left: auto;
-            margin-right: 0;
-        }
-
-        .bot-message {
-            background: rgba(255, 255, 255, 0.1);
-            color: var(--text-color);
-            border-bottom-left-radius: 4px;
-            margin-right: auto;
-            margin-left: 0;
-            white-space: pre-wrap;
-            line-height: 1.6;
-            padding: 16px 20px;
-            font-size: 0.95em;
-        }
-
-        .typing-indicator {
-            position: fixed;
-            bottom: 85px;
-            left: calc(50% - 380px);
-            background: var(--bg-message-bot);
-            padding: 8px 12px;
-            border-radius: 18px;
-            border-bottom-left-radius: 4px;
-            display: none;
-            align-items: center;
-            gap: 6px;
-            max-width: 200px;
-            width: auto;
-            z-index: 1000;
-        }
-
-        .typing-indicator span {
-            color: var(--text-color);
-            font-size: 0.9rem;
-            font-weight: 500;
-            white-space: nowrap;
-        }
-
-        .typing-dots {
-            display: flex;
-            gap: 3px;
-        }
-
-        .typing-dot {
-            width: 5px;
-            height: 5px;
-            background: var(--primary-color);
-            border-radius: 50%;
-            animation: bounce 1.4s infinite ease-in-out;
-        }
-
-        .typing-dot:nth-child(1) {
-            animation-delay: -0.32s;
-        }
-
-        .typing-dot:nth-child(2) {
-            animation-delay: -0.16s;
-        }
-
-        .typing-dot:nth-child(3) {
-            animation-delay: 0s;
-        }
-
-        .chat-input {
-            padding: 15px 20px;
-            border-top: none;
-            background: rgba(0, 0, 0, 0.3);
-            position: fixed;
-            bottom: 0;
-            left: 0;
-            right: 0;
-            max-width: 800px;
-            margin: 0 auto;
-            z-index: 1000;
-            flex-shrink: 0;
-            backdrop-filter: blur(5px);
-            width: 100%;
-        }
-
-        .input-group {
-            display: flex;
-            gap: 12px;
-            align-items: center;
-            width: 100%;
-            max-width: 800px;
-            margin: 0 auto;
-        }
-
-        #userInput {
-            flex: 1;
-            padding: 12px 16px;
-            border: none;
-            border-radius: 25px;
-            font-size: 15px;
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, sans-serif;
-            font-weight: normal;
-            outline: none;
-            background: rgba(255, 255, 255, 0.1);
-            color: var(--text-color);
-            transition: all 0.2s;
-            min-height: 44px;
-        }
-
-        #userInput::placeholder {
-            color: rgba(255, 255, 255, 0.6);
-            font-weight: normal;
-        }
-
-        #userInput:focus {
-            border: none;
-            background: rgba(255, 255, 255, 0.15);
-        }
-
-        #sendButton {
-            background: rgba(0, 122, 255, 0.4);
-            color: var(--text-color);
-            border: none;
-            padding: 12px 20px;
-            border-radius: 25px;
-            font-size: 16px;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.2s;
-            min-width: 60px;
-            min-height: 44px;
-        }
-
-        #sendButton:hover:not(:disabled) {
-            background: rgba(0, 86, 204, 0.5);
-            transform: translateY(-1px);
-        }
-
-        #sendButton:disabled {
-            opacity: 0.6;
-            cursor: not-allowed;
-        }
-
-        .error-message {
-            background: var(--error-color);
-            color: var(--text-color);
-            padding: 12px;
-            border-radius: 8px;
-            margin: 0 auto 12px auto;
-            display: none;
-            text-align: center;
-            font-size: 14px;
-            max-width: 70%;
-        }
-
-        @keyframes slideIn {
-            from {
-                opacity: 0;
-                transform: translateY(8px);
-                filter: blur(2px);
-            }
-
-            to {
-                opacity: 1;
-                transform: translateY(0);
-                filter: blur(0);
-            }
-        }
-
-        @keyframes bounce {
-
-            0%,
-            80%,
-            100% {
-                transform: scale(0);
-            }
-
-            40% {
-                transform: scale(1);
-            }
-        }
-
-        @media (max-width: 768px) {
-            .chat-header {
-                padding: 12px 15px;
-                padding-top: env(safe-area-inset-top, 12px);
-            }
-
-            .chat-header h1 {
-                font-size: 1.3rem;
-                margin-bottom: 4px;
-            }
-
-            .chat-header p {
-                font-size: 0.8rem;
-            }
-
-            .chat-messages {
-                padding: 15px;
-                padding-top: calc(80px + env(safe-area-inset-top, 0px));
-                padding-bottom: calc(80px + env(safe-area-inset-bottom, 0px));
-            }
-
-            .message {
-                max-width: 90%;
-                padding: 10px 14px;
-                font-size: 0.95em;
-            }
-
-            .typing-indicator {
-                bottom: calc(80px + env(safe-area-inset-bottom, 0px));
-                left: 35px;
-                padding: 6px 10px;
-            }
-
-            .chat-input {
-                padding: 10px 15px;
-                padding-bottom: calc(10px + env(safe-area-inset-bottom, 0px));
-            }
-
-            .input-group {
-                gap: 8px;
-                padding: 0 5px;
-            }
-
-            #userInput {
-                padding: 10px 14px;
-                font-size: 15px;
-                min-height: 40px;
-            }
-
-            #sendButton {
-                padding: 10px 16px;
-                font-size: 15px;
-                min-width: 50px;
-                min-height: 40px;
-            }
-
-            .error-message {
-                max-width: 90%;
-                font-size: 13px;
-                padding: 10px;
-                margin: 0 auto 10px auto;
-            }
-        }
-
-        /* iPhone X and newer safe area support */
-        @supports (padding: max(0px)) {
-            .chat-container {
-                padding-top: env(safe-area-inset-top);
-                padding-bottom: env(safe-area-inset-bottom);
-                padding-left: env(safe-area-inset-left);
-                padding-right: env(safe-area-inset-right);
-            }
-        }
-
-        /* Landscape mode adjustments */
-        @media (max-width: 768px) and (orientation: landscape) {
-            .chat-header {
-                padding: 8px;
-            }
-
-            .chat-messages {
-                padding-top: 60px;
-                padding-bottom: 60px;
-            }
-
-            .chat-input {
-                padding: 8px;
-            }
-
-            #userInput,
-            #sendButton {
-                min-height: 36px;
-            }
-        }
-
-        /* Small screen adjustments */
-        @media (max-width: 360px) {
-            .chat-header h1 {
-                font-size: 1.2rem;
-            }
-
-            .chat-header p {
-                font-size: 0.75rem;
-            }
-
-            .message {
-                max-width: 95%;
-                padding: 8px 12px;
-                font-size: 0.9em;
-            }
-
-            #userInput {
-                font-size: 14px;
-            }
-
-            #sendButton {
-                font-size: 14px;
-                padding: 8px 14px;
-            }
-        }
-
-        .chat-messages::-webkit-scrollbar {
-            width: 6px;
-        }
-
-        .chat-messages::-webkit-scrollbar-track {
-            background: transparent;
-        }
-
-        .chat-messages::-webkit-scrollbar-thumb {
-            background: rgba(255, 255, 255, 0.2);
-            border-radius: 3px;
-        }
-
-        .typing-dots .text {
-            display: inline-block;
-            margin-right: 2px;
-        }
-
-        .typing-dots .dot {
-            display: inline-block;
-            animation: dotAnimation 1.4s infinite;
-            opacity: 0;
-        }
-
-        .typing-dots .dot:nth-child(2) {
-            animation-delay: 0.2s;
-        }
-
-        .typing-dots .dot:nth-child(3) {
-            animation-delay: 0.4s;
-        }
-
-        @keyframes dotAnimation {
-
-            0%,
-            20% {
-                opacity: 0;
-            }
-
-            50% {
-                opacity: 1;
-            }
-
-            80%,
-            100% {
-                opacity: 0;
-            }
-        }
-
-        .bot-message strong {
-            font-weight: 600;
-            color: #fff;
-        }
-        .bot-message em {
-            font-style: italic;
-            color: rgba(255, 255, 255, 0.9);
-        }
-        .bot-message code {
-            background: rgba(0, 0, 0, 0.2);
-            padding: 2px 4px;
-            border-radius: 4px;
-            font-family: monospace;
-        }
-        .bot-message pre {
-            background: rgba(0, 0, 0, 0.2);
-            padding: 12px;
-            border-radius: 8px;
-            overflow-x: auto;
-            margin: 8px 0;
-        }
-        .bot-message pre code {
-            background: none;
-            padding: 0;
-        }
-        .bot-message li {
-            margin-left: 20px;
-            margin-bottom: 4px;
-        }
-    </style>
-</head>
-
-<body>
-    <div class="chat-container">
-        <div class="chat-header">
-            <h1>AI Chatbot</h1>
-            <p>Powered by DeepSeek via OpenRouter</p>
-        </div>
-
-        <div class="chat-messages" id="chatMessages">
-            <div class="error-message" id="errorMessage"></div>
-        </div>
-
-        <div class="typing-indicator" id="typingIndicator">
-            <div class="typing-dots">
-                <span class="text">AI is thinking</span><span class="dot">.</span><span class="dot">.</span><span
-                    class="dot">.</span>
-            </div>
-        </div>
-
-        <div class="chat-input">
-            <div class="input-group">
-                <textarea id="userInput" placeholder="Type your message here..." rows="1" maxlength="4000"></textarea>
-                <button id="sendButton">
-                    <span class="button-text">Send</span>
-                    <div class="loading-spinner"></div>
-                </button>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        const elements = {
-            chatMessages: document.getElementById('chatMessages'),
-            userInput: document.getElementById('userInput'),
-            sendButton: document.getElementById('sendButton'),
-            typingIndicator: document.getElementById('typingIndicator'),
-            errorMessage: document.getElementById('errorMessage'),
-            buttonText: document.querySelector('.button-text'),
-            loadingSpinner: document.querySelector('.loading-spinner')
-        };
-
-        let isLoading = false;
-
-        // Auto-resize textarea
-        function autoResize(textarea) {
-            textarea.style.height = 'auto';
-            textarea.style.height = Math.min(textarea.scrollHeight, 120) + 'px';
-        }
-
-        elements.userInput.addEventListener('input', function () {
-            autoResize(this);
-        });
-
-        function scrollToBottom() {
-            setTimeout(() => {
-                elements.chatMessages.scrollTop = elements.chatMessages.scrollHeight;
-            }, 50);
-        }
-
-        function addMessage(content, isUser) {
-            const messageDiv = document.createElement('div');
-            messageDiv.className = `message ${isUser ? 'user-message' : 'bot-message'}`;
-            messageDiv.innerHTML = content;
-            elements.chatMessages.appendChild(messageDiv);
-            scrollToBottom();
-            return messageDiv;
-        }
-
-        function updateBotMessage(messageDiv, content) {
-            messageDiv.innerHTML = content;
-            scrollToBottom();
-        }
-
-        function showError(message) {
-            elements.errorMessage.textContent = message;
-            elements.errorMessage.style.display = 'block';
-            setTimeout(() => {
-                elements.errorMessage.style.display = 'none';
-            }, 5000);
-        }
-
-        function setLoading(loading) {
-            isLoading = loading;
-            elements.sendButton.disabled = loading;
-            elements.buttonText.style.display = loading ? 'none' : 'inline';
-            elements.loadingSpinner.style.display = loading ? 'inline-block' : 'none';
-
-            scrollToBottom();
-        }
-
-        async function sendMessage() {
-            const message = elements.userInput.value.trim();
-
-            if (!message || isLoading) return;
-
-            elements.userInput.value = '';
-            elements.userInput.style.height = 'auto';
-            setLoading(true);
-
-            addMessage(message, true);
-            const botMessageDiv = addMessage('', false);
-
-            try {
-                const response = await fetch('/api/chat', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({ message: message })
-                });
-
-                if (!response.ok) {
-                    const errorData = await response.json();
-                    throw new Error(errorData.detail || 'Server error');
-                }
-
-                const reader = response.body.getReader();
-                const decoder = new TextDecoder();
-                let botResponse = '';
-
-                while (true) {
-                    const { value, done } = await reader.read();
-                    if (done) break;
-
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\\n');
-
-                    for (const line of lines) {
-                        if (line.startsWith('data: ')) {
-                            try {
-                                const data = JSON.parse(line.slice(6));
-                                if (data.error) {
-                                    throw new Error(data.error);
-                                }
-                                if (data.content) {
-                                    botResponse += data.content;
-                                    updateBotMessage(botMessageDiv, botResponse);
-                                }
-                            } catch (e) {
-                                console.warn('Error parsing SSE data:', e);
-                            }
-                        }
-                    }
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                showError(error.message);
-                botMessageDiv.textContent = 'Sorry, I encountered an error. Please try again.';
-            } finally {
-                setLoading(false);
-            }
-        }
-
-        elements.sendButton.addEventListener('click', sendMessage);
-
-        elements.userInput.addEventListener('keydown', (e) => {
-            if (e.key === 'Enter' && !e.shiftKey) {
-                e.preventDefault();
-                sendMessage();
-            }
-        });
-
-        // Handle mobile viewport and window resize
-        function handleViewport() {
-            const vh = window.innerHeight * 0.01;
-            document.documentElement.style.setProperty('--vh', `${vh}px`);
-
-            // Force layout recalculation
-            const chatContainer = document.querySelector('.chat-container');
-            if (chatContainer) {
-                chatContainer.style.height = `${window.innerHeight}px`;
-            }
-        }
-
-        // Debounce resize events
-        let resizeTimeout;
-        function debouncedHandleViewport() {
-            clearTimeout(resizeTimeout);
-            resizeTimeout = setTimeout(handleViewport, 100);
-        }
-
-        window.addEventListener('resize', debouncedHandleViewport);
-        window.addEventListener('orientationchange', () => {
-            setTimeout(handleViewport, 300); // Delay for orientation change
-        });
-        handleViewport();
-
-        // Add welcome message
-        setTimeout(() => {
-            addMessage("Hello! I'm your AI assistant powered by DeepSeek. How can I help you today?", false);
-        }, 500);
-    </script>
-</body>
-
-</html>'''
-    
-    # Write the HTML file
-    with open("index.html", "w", encoding="utf-8") as f:
-        f.write(html_content)
+    from serve import main
     
-    # Create a simple background image placeholder (you can replace this with the actual image)
-    print("📁 Created index.html file")
     print("🌐 Starting server on http://localhost:8000")
     print("🤖 Chatbot ready with live streaming!")
     print("🔑 Using OpenRouter API with DeepSeek model")
@@ -869,5 +1133,5 @@ if __name__ == "__main__":
     print("✅ Real-time streaming responses")
     print("="*50 + "\n")
     
-    # Run the server
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    # Run the server: one worker per core, draining live streams on SIGTERM (see serve.py for options)
+    main()
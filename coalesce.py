@@ -0,0 +1,94 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from usage import Usage
+
+OnComplete = Callable[[str], Awaitable[None]]
+OnUsage = Callable[[Usage], None]
+Factory = Callable[[OnComplete, OnUsage], AsyncIterator[bytes]]
+
+
+class SharedStream:
+    """One upstream stream whose frames are buffered and fanned out to every subscriber"""
+
+    def __init__(self, factory: Factory):
+        self.frames = []
+        self.done = False
+        self.subscribers = 0
+        self.callbacks: List[OnComplete] = []
+        self.usage_callbacks: List[OnUsage] = []
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(factory(self._complete, self._usage)))
+
+    async def _complete(self, text: str) -> None:
+        for callback in self.callbacks:
+            await callback(text)
+
+    def _usage(self, usage: Usage) -> None:
+        # Every subscriber got the whole answer, so each is charged for it
+        for callback in self.usage_callbacks:
+            callback(usage)
+
+    async def _pump(self, source: AsyncIterator[bytes]) -> None:
+        try:
+            async for frame in source:
+                self.frames.append(frame)
+                self._notify()
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncGenerator[bytes, None]:
+        """Yield the buffered prefix in one write, then the live tail"""
+        index = 0
+        try:
+            while True:
+                if index < len(self.frames):
+                    chunk = b"".join(self.frames[index:])
+                    index = len(self.frames)
+                    yield chunk
+                elif self.done:
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class StreamCoalescer:
+    """Single-flight: identical in-flight prompts share one upstream stream"""
+
+    def __init__(self):
+        self._inflight: Dict[str, SharedStream] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+    def subscribe(self, key: str, factory: Factory, on_complete: Optional[OnComplete] = None,
+                  on_usage: Optional[OnUsage] = None) -> AsyncGenerator[bytes, None]:
+        """Join the stream for `key`, starting it with `factory` if nobody else is waiting on it
+
+        `on_complete` is called with the full answer for every subscriber once the stream finishes,
+        and `on_usage` with the generation's token usage.
+        """
+        stream = self._inflight.get(key)
+        if stream is None:
+            stream = SharedStream(factory)
+            self._inflight[key] = stream
+            stream.task.add_done_callback(lambda _: self._forget(key, stream))
+        stream.subscribers += 1
+        if on_complete is not None:
+            stream.callbacks.append(on_complete)
+        if on_usage is not None:
+            stream.usage_callbacks.append(on_usage)
+        return stream.subscribe()
+
+    def _forget(self, key: str, stream: SharedStream) -> None:
+        if self._inflight.get(key) is stream:
+            del self._inflight[key]
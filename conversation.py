@@ -0,0 +1,149 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+# Rough per-message overhead of the chat template, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def build_context(history: List[Dict[str, str]], message: str, max_tokens: int,
+                  summary_tokens: int) -> List[Dict[str, str]]:
+    """Fit the newest turns plus the new user message into max_tokens
+
+    Turns that no longer fit are folded into a short note listing the earlier user questions,
+    so the model keeps the gist of the conversation without the full text.
+    """
+    user_turn = {"role": "user", "content": message}
+    budget = max_tokens - estimate_tokens(message) - MESSAGE_OVERHEAD_TOKENS
+    kept: List[Dict[str, str]] = []
+    index = len(history)
+    while index > 0:
+        cost = estimate_tokens(history[index - 1]["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if cost > budget:
+            break
+        budget -= cost
+        index -= 1
+        kept.append(history[index])
+    kept.reverse()
+
+    dropped = [turn["content"] for turn in history[:index] if turn["role"] == "user"]
+    if dropped and summary_tokens > 0:
+        note = "Earlier in this conversation the user asked: "
+        remaining = summary_tokens - estimate_tokens(note)
+        questions = []
+        for question in reversed(dropped):
+            question = " ".join(question.split())[:120]
+            cost = estimate_tokens(question) + 1
+            if cost > remaining:
+                break
+            remaining -= cost
+            questions.append(question)
+        if questions:
+            questions.reverse()
+            kept.insert(0, {"role": "system", "content": note + "; ".join(questions)})
+
+    kept.append(user_turn)
+    return kept
+
+
+class SQLiteConversationLog:
+    """Append-only turn log so conversations survive restarts and in-memory eviction"""
+
+    def __init__(self, path: str, idle_ttl: float):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id)")
+        self._db.execute(
+            "DELETE FROM turns WHERE conversation_id IN ("
+            "SELECT conversation_id FROM turns GROUP BY conversation_id HAVING MAX(created_at) < ?)",
+            (time.time() - idle_ttl,),
+        )
+
+    def load(self, conversation_id: str, limit: int) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM turns WHERE conversation_id = ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, limit),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def append(self, conversation_id: str, turns: List[Dict[str, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO turns (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(conversation_id, turn["role"], turn["content"], now) for turn in turns],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class ConversationStore:
+    """In-memory conversations with LRU eviction of idle sessions and optional SQLite persistence"""
+
+    def __init__(self, max_sessions: int, idle_ttl: float, max_turns: int,
+                 log: Optional[SQLiteConversationLog] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.log = log
+        self._sessions: "OrderedDict[str, tuple[float, Deque[Dict[str, str]]]]" = OrderedDict()
+
+    async def history(self, conversation_id: str) -> List[Dict[str, str]]:
+        self._evict_idle()
+        session = self._sessions.get(conversation_id)
+        if session is not None:
+            self._store(conversation_id, session[1])
+            return list(session[1])
+        if self.log is None:
+            return []
+        turns = await asyncio.to_thread(self.log.load, conversation_id, self.max_turns)
+        if turns:
+            self._store(conversation_id, deque(turns, maxlen=self.max_turns))
+        return turns
+
+    async def append(self, conversation_id: str, *turns: Dict[str, str]) -> None:
+        if conversation_id not in self._sessions and self.log is not None:
+            await self.history(conversation_id)
+        session = self._sessions.get(conversation_id)
+        history = session[1] if session is not None else deque(maxlen=self.max_turns)
+        history.extend(turns)
+        self._store(conversation_id, history)
+        if self.log is not None:
+            await asyncio.to_thread(self.log.append, conversation_id, list(turns))
+
+    def _store(self, conversation_id: str, history: Deque[Dict[str, str]]) -> None:
+        self._sessions[conversation_id] = (time.monotonic(), history)
+        self._sessions.move_to_end(conversation_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if self._sessions[oldest][0] >= cutoff:
+                break
+            del self._sessions[oldest]
+
+    def close(self) -> None:
+        self._sessions.clear()
+        if self.log is not None:
+            self.log.close()
@@ -0,0 +1,616 @@
+const elements = {
+    chatMessages: document.getElementById('chatMessages'),
+    userInput: document.getElementById('userInput'),
+    sendButton: document.getElementById('sendButton'),
+    typingIndicator: document.getElementById('typingIndicator'),
+    errorMessage: document.getElementById('errorMessage'),
+    messageList: document.getElementById('messageList'),
+    buttonText: document.querySelector('.button-text'),
+    loadingSpinner: document.querySelector('.loading-spinner')
+};
+
+let isLoading = false;
+let conversationId = null;
+
+// Auto-resize textarea
+function autoResize(textarea) {
+    textarea.style.height = 'auto';
+    textarea.style.height = Math.min(textarea.scrollHeight, 120) + 'px';
+}
+
+elements.userInput.addEventListener('input', function () {
+    autoResize(this);
+});
+
+// Message list virtualization: only the messages in and near the viewport are in the DOM.
+// The rest are represented by padding on the list, using heights measured when they were last
+// shown. Finished messages are also written to IndexedDB, so the text of turns far from the
+// viewport can be dropped from memory and read back when the user scrolls to them.
+const MESSAGE_GAP = 12;         // matches .message-list gap
+const ESTIMATED_HEIGHT = 72;    // height assumed for a message before it is first measured
+const OVERSCAN = 8;             // messages rendered beyond each edge of the viewport
+const KEEP_IN_MEMORY = 100;     // messages either side of the rendered window whose text stays in memory
+const HISTORY_MAX_AGE = 7 * 24 * 60 * 60 * 1000;
+
+// { seq, isUser, text, height, node, stored, fresh }; text is null while it only lives in IndexedDB
+const messages = [];
+let windowStart = 0;
+let windowEnd = 0;
+
+const messageStore = (() => {
+    // Each tab keeps its own history; leftovers from old sessions are swept on open
+    const session = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    let opened = null;
+
+    function request(req) {
+        return new Promise((resolve, reject) => {
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => reject(req.error);
+        });
+    }
+
+    function open() {
+        if (!opened) {
+            opened = new Promise((resolve, reject) => {
+                if (!window.indexedDB) throw new Error('IndexedDB is not available');
+                const req = indexedDB.open('chatbot-history', 1);
+                req.onupgradeneeded = () => {
+                    const store = req.result.createObjectStore('messages', { keyPath: ['s', 'q'] });
+                    store.createIndex('t', 't');
+                };
+                req.onsuccess = () => resolve(req.result);
+                req.onerror = () => reject(req.error);
+            });
+            opened.then(db => {
+                const stale = IDBKeyRange.upperBound(Date.now() - HISTORY_MAX_AGE);
+                const store = db.transaction('messages', 'readwrite').objectStore('messages');
+                store.index('t').openKeyCursor(stale).onsuccess = (e) => {
+                    const cursor = e.target.result;
+                    if (!cursor) return;
+                    store.delete(cursor.primaryKey);
+                    cursor.continue();
+                };
+            }, e => console.warn('Chat history will stay in memory:', e));
+        }
+        return opened;
+    }
+
+    return {
+        async put(message) {
+            const db = await open();
+            const store = db.transaction('messages', 'readwrite').objectStore('messages');
+            // Short field names: these records are the compact form of the conversation
+            await request(store.put({ s: session, q: message.seq, u: message.isUser ? 1 : 0, x: message.text, t: Date.now() }));
+        },
+        async getRange(first, last) {
+            const db = await open();
+            const store = db.transaction('messages').objectStore('messages');
+            return request(store.getAll(IDBKeyRange.bound([session, first], [session, last])));
+        }
+    };
+})();
+
+function persistMessage(message) {
+    messageStore.put(message).then(() => {
+        message.stored = true;
+    }, () => {});
+}
+
+let hydrating = false;
+function hydrate(first, last) {
+    if (hydrating) return;
+    hydrating = true;
+    messageStore.getRange(messages[first].seq, messages[last - 1].seq).then(records => {
+        for (const record of records) {
+            const message = messages[record.q];
+            if (message.text === null) message.text = record.x;
+        }
+    }, e => console.warn('Could not restore messages:', e)).finally(() => {
+        // Whatever couldn't be read back is gone; show it empty rather than asking again every frame
+        for (let i = first; i < last; i++) {
+            if (messages[i].text === null) messages[i].text = '';
+        }
+        hydrating = false;
+        scheduleRender();
+    });
+}
+
+function createMessageNode(message) {
+    const node = document.createElement('div');
+    node.className = `message ${message.isUser ? 'user-message' : 'bot-message'}`;
+    if (message.fresh) {
+        // Only new messages animate in; ones scrolled back into view just appear
+        node.classList.add('fresh');
+        message.fresh = false;
+    }
+    if (message.text === null) {
+        node.classList.add('placeholder');
+        node.style.minHeight = `${message.height - MESSAGE_GAP}px`;
+    }
+    // Always one text node, so streamed tokens can be appended to it
+    node.appendChild(document.createTextNode(message.text || ''));
+    return node;
+}
+
+function renderWindow(atBottom) {
+    const container = elements.chatMessages;
+    const list = elements.messageList;
+    let total = 0;
+    for (const message of messages) total += message.height;
+    const viewTop = atBottom
+        ? total - container.clientHeight
+        : container.scrollTop - list.offsetTop;
+    const viewBottom = viewTop + container.clientHeight;
+
+    let first = 0;
+    let top = 0;
+    while (first < messages.length - 1 && top + messages[first].height <= viewTop) {
+        top += messages[first].height;
+        first++;
+    }
+    let last = first;
+    let bottom = top;
+    while (last < messages.length && bottom < viewBottom) {
+        bottom += messages[last].height;
+        last++;
+    }
+    const visibleFirst = first;
+    first = Math.max(0, first - OVERSCAN);
+    last = Math.min(messages.length, last + OVERSCAN);
+
+    for (let i = windowStart; i < windowEnd; i++) {
+        if ((i < first || i >= last) && messages[i].node) {
+            messages[i].node.remove();
+            messages[i].node = null;
+        }
+    }
+    let previous = null;
+    let needsText = false;
+    for (let i = first; i < last; i++) {
+        const message = messages[i];
+        if (message.node && message.text !== null && message.node.classList.contains('placeholder')) {
+            message.node.remove();
+            message.node = null;
+        }
+        if (!message.node) {
+            message.node = createMessageNode(message);
+            if (previous) previous.after(message.node);
+            else list.prepend(message.node);
+        }
+        needsText = needsText || message.text === null;
+        previous = message.node;
+    }
+    windowStart = first;
+    windowEnd = last;
+
+    // Read every height after all the writes above: one layout per frame
+    let shift = 0;
+    for (let i = first; i < last; i++) {
+        const message = messages[i];
+        const height = message.node.offsetHeight + MESSAGE_GAP;
+        if (height !== message.height) {
+            // Keep what the reader is looking at in place when something above it changes size
+            if (i < visibleFirst) shift += height - message.height;
+            message.height = height;
+        }
+    }
+
+    let before = 0;
+    let after = 0;
+    for (let i = 0; i < first; i++) before += messages[i].height;
+    for (let i = last; i < messages.length; i++) after += messages[i].height;
+    list.style.paddingTop = `${before}px`;
+    list.style.paddingBottom = `${after}px`;
+    if (shift && !atBottom) container.scrollBy({ top: shift, behavior: 'instant' });
+
+    for (let i = 0; i < messages.length; i++) {
+        const message = messages[i];
+        if (message.stored && message.text !== null && (i < first - KEEP_IN_MEMORY || i >= last + KEEP_IN_MEMORY)) {
+            message.text = null;
+        }
+    }
+    if (needsText) hydrate(first, last);
+}
+
+// One render per frame, however many updates ask for one
+let renderFrame = 0;
+let stickToBottom = false;
+function scheduleRender(toBottom = false) {
+    stickToBottom = stickToBottom || toBottom;
+    if (renderFrame) return;
+    renderFrame = requestAnimationFrame(() => {
+        renderFrame = 0;
+        const atBottom = stickToBottom;
+        stickToBottom = false;
+        renderWindow(atBottom);
+        if (atBottom) elements.chatMessages.scrollTop = elements.chatMessages.scrollHeight;
+    });
+}
+
+function scrollToBottom() {
+    scheduleRender(true);
+}
+
+elements.chatMessages.addEventListener('scroll', () => scheduleRender(), { passive: true });
+
+function isNearBottom() {
+    const list = elements.chatMessages;
+    return list.scrollHeight - list.scrollTop - list.clientHeight < 80;
+}
+
+function addMessage(content, isUser, streaming = false) {
+    const message = {
+        seq: messages.length,
+        isUser,
+        text: content,
+        height: ESTIMATED_HEIGHT,
+        node: null,
+        stored: false,
+        fresh: true
+    };
+    messages.push(message);
+    if (!streaming) persistMessage(message);
+    scrollToBottom();
+    return message;
+}
+
+function setMessageText(message, text) {
+    message.text = text;
+    if (message.node) message.node.firstChild.data = text;
+    persistMessage(message);
+    scheduleRender();
+}
+
+// Appends streamed text to a message as it arrives. Tokens are buffered and written once per
+// animation frame into a single text node, so each frame costs O(new text) rather than
+// re-rendering the whole answer.
+function createStreamRenderer(message) {
+    let pending = '';
+    let frame = 0;
+
+    function flush() {
+        frame = 0;
+        if (!pending) return;
+        // Only follow the answer if the reader hasn't scrolled up to read something else
+        const follow = isNearBottom();
+        message.text += pending;
+        if (message.node) message.node.firstChild.appendData(pending);
+        pending = '';
+        if (follow) scrollToBottom();
+    }
+
+    return {
+        push(text) {
+            pending += text;
+            if (!frame) frame = requestAnimationFrame(flush);
+        },
+        finish() {
+            if (frame) cancelAnimationFrame(frame);
+            flush();
+            scheduleRender();
+            persistMessage(message);
+        },
+        get text() {
+            return message.text + pending;
+        }
+    };
+}
+
+// Incremental SSE parser: bytes may split anywhere, so incomplete events are carried over to the next read
+function createSSEParser(onEvent) {
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    function dispatch(block) {
+        const event = { id: null, data: [] };
+        for (const line of block.split('\n')) {
+            const colon = line.indexOf(':');
+            // Lines starting with ':' are comments (keep-alives)
+            if (colon === 0) continue;
+            const field = colon === -1 ? line : line.slice(0, colon);
+            let value = colon === -1 ? '' : line.slice(colon + 1);
+            if (value.startsWith(' ')) value = value.slice(1);
+            if (field === 'data') event.data.push(value);
+            else if (field === 'id') event.id = value;
+        }
+        if (event.data.length) onEvent({ id: event.id, data: event.data.join('\n') });
+    }
+
+    function drain() {
+        buffer = buffer.replace(/\r\n?/g, '\n');
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            dispatch(buffer.slice(0, end));
+            buffer = buffer.slice(end + 2);
+        }
+    }
+
+    return {
+        feed(bytes) {
+            // stream: true keeps multi-byte characters split across reads intact
+            buffer += decoder.decode(bytes, { stream: true });
+            drain();
+        },
+        end() {
+            buffer += decoder.decode();
+            drain();
+            if (buffer.trim()) dispatch(buffer);
+            buffer = '';
+        }
+    };
+}
+
+function showError(message) {
+    elements.errorMessage.textContent = message;
+    elements.errorMessage.style.display = 'block';
+    setTimeout(() => {
+        elements.errorMessage.style.display = 'none';
+    }, 5000);
+}
+
+// One answer being generated: where its text goes and how far its stream has got
+function createChatRequest(id, renderer) {
+    return {
+        id,
+        renderer,
+        error: null,
+        streamId: null,
+        lastEventId: null,
+        cancel: () => {},
+        onEvent({ id: eventId, data }) {
+            if (eventId) this.lastEventId = eventId;
+            let payload;
+            try {
+                payload = JSON.parse(data);
+            } catch (e) {
+                console.warn('Error parsing SSE data:', e);
+                return;
+            }
+            if (payload.error) this.error = payload.error;
+            else if (payload.content) this.renderer.push(payload.content);
+        }
+    };
+}
+
+// Feed a response body through the SSE parser until it ends or reports an error
+async function readEventStream(response, request) {
+    const reader = response.body.getReader();
+    const parser = createSSEParser((event) => request.onEvent(event));
+    while (!request.error) {
+        const { value, done } = await reader.read();
+        if (done) {
+            parser.end();
+            break;
+        }
+        parser.feed(value);
+    }
+    if (request.error) reader.cancel().catch(() => {});
+}
+
+async function streamOverHttp(request, message) {
+    const controller = new AbortController();
+    request.cancel = () => controller.abort();
+    const response = await fetch('/api/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ message: message, conversation_id: conversationId }),
+        signal: controller.signal
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Server error');
+    }
+
+    conversationId = response.headers.get('X-Conversation-ID') || conversationId;
+    await readEventStream(response, request);
+}
+
+// Pick a dropped stream back up from the last frame received
+async function resumeOverHttp(request) {
+    const controller = new AbortController();
+    request.cancel = () => controller.abort();
+    const response = await fetch(`/api/chat/stream/${request.streamId}`, {
+        headers: request.lastEventId ? { 'Last-Event-ID': request.lastEventId } : {},
+        signal: controller.signal
+    });
+    if (!response.ok) throw new Error('Connection lost. Please try again.');
+    await readEventStream(response, request);
+}
+
+// Several answers can stream at once over one WebSocket; each binary message is
+// "<request id>\n" followed by the same SSE frames /api/chat sends. If the socket
+// can't be opened we fall back to one POST per message.
+const chatSocket = {
+    socket: null,
+    opening: null,
+    unavailable: !('WebSocket' in window),
+    requests: new Map(),
+    decoder: new TextDecoder(),
+
+    open() {
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) return Promise.resolve(this.socket);
+        if (this.opening) return this.opening;
+        this.opening = new Promise((resolve, reject) => {
+            const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const socket = new WebSocket(`${scheme}//${location.host}/ws/chat`);
+            socket.binaryType = 'arraybuffer';
+            socket.onopen = () => {
+                this.socket = socket;
+                this.opening = null;
+                resolve(socket);
+            };
+            socket.onerror = () => {
+                if (this.opening) {
+                    this.opening = null;
+                    this.unavailable = true;
+                    reject(new Error('WebSocket unavailable'));
+                }
+            };
+            socket.onmessage = (event) => this.receive(event.data);
+            socket.onclose = () => this.closed(socket);
+        });
+        return this.opening;
+    },
+
+    receive(data) {
+        if (typeof data !== 'string') {
+            const bytes = new Uint8Array(data);
+            const newline = bytes.indexOf(10);
+            const entry = this.requests.get(this.decoder.decode(bytes.subarray(0, newline)));
+            if (entry) entry.parser.feed(bytes.subarray(newline + 1));
+            return;
+        }
+        const message = JSON.parse(data);
+        const entry = this.requests.get(message.id);
+        if (!entry) {
+            if (message.type === 'error') console.warn('Chat socket error:', message.detail);
+            return;
+        }
+        if (message.type === 'start') {
+            entry.request.streamId = message.stream_id;
+            conversationId = message.conversation_id || conversationId;
+        } else if (message.type === 'done') {
+            this.requests.delete(message.id);
+            entry.resolve();
+        } else if (message.type === 'error') {
+            this.requests.delete(message.id);
+            entry.reject(new Error(message.detail || 'Server error'));
+        }
+    },
+
+    closed(socket) {
+        if (this.socket === socket) this.socket = null;
+        // Streams survive the connection on the server for a while; finish them over HTTP
+        for (const [id, entry] of this.requests) {
+            this.requests.delete(id);
+            if (entry.request.streamId) resumeOverHttp(entry.request).then(entry.resolve, entry.reject);
+            else entry.reject(new Error('Connection lost. Please try again.'));
+        }
+    },
+
+    async stream(request, message) {
+        const socket = await this.open();
+        await new Promise((resolve, reject) => {
+            const parser = createSSEParser((event) => request.onEvent(event));
+            this.requests.set(request.id, { request, parser, resolve, reject });
+            request.cancel = () => {
+                if (socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({ type: 'cancel', id: request.id }));
+            };
+            socket.send(JSON.stringify({ type: 'chat', id: request.id, message: message, conversation_id: conversationId }));
+        });
+    }
+};
+
+// Answers that can stream at once: the server's default per-connection limit on the socket, one over HTTP
+const MAX_PARALLEL_SOCKET = 4;
+const activeRequests = new Map();
+let nextRequestId = 1;
+
+function maxInFlight() {
+    return chatSocket.unavailable ? 1 : MAX_PARALLEL_SOCKET;
+}
+
+function setLoading() {
+    isLoading = activeRequests.size >= maxInFlight();
+    elements.sendButton.disabled = isLoading;
+    elements.buttonText.style.display = isLoading ? 'none' : 'inline';
+    elements.loadingSpinner.style.display = isLoading ? 'inline-block' : 'none';
+
+    scrollToBottom();
+}
+
+function cancelAll() {
+    for (const request of activeRequests.values()) request.cancel();
+}
+
+async function sendMessage() {
+    const message = elements.userInput.value.trim();
+
+    if (!message || isLoading) return;
+
+    elements.userInput.value = '';
+    elements.userInput.style.height = 'auto';
+
+    addMessage(message, true);
+    const botMessage = addMessage('', false, true);
+    const renderer = createStreamRenderer(botMessage);
+    const request = createChatRequest(String(nextRequestId++), renderer);
+    activeRequests.set(request.id, request);
+    setLoading();
+
+    try {
+        let sent = false;
+        if (!chatSocket.unavailable) {
+            try {
+                await chatSocket.stream(request, message);
+                sent = true;
+            } catch (e) {
+                if (!chatSocket.unavailable) throw e;
+            }
+        }
+        if (!sent) await streamOverHttp(request, message);
+        if (request.error) throw new Error(request.error);
+        renderer.finish();
+    } catch (error) {
+        renderer.finish();
+        if (error.name === 'AbortError') return;
+        console.error('Error:', error);
+        showError(error.message);
+        setMessageText(botMessage, 'Sorry, I encountered an error. Please try again.');
+    } finally {
+        activeRequests.delete(request.id);
+        setLoading();
+    }
+}
+
+elements.sendButton.addEventListener('click', sendMessage);
+
+elements.userInput.addEventListener('keydown', (e) => {
+    if (e.key === 'Enter' && !e.shiftKey) {
+        e.preventDefault();
+        sendMessage();
+    } else if (e.key === 'Escape') {
+        // Stop every answer still being generated
+        cancelAll();
+    }
+});
+
+// Handle mobile viewport and window resize
+function handleViewport() {
+    const vh = window.innerHeight * 0.01;
+    document.documentElement.style.setProperty('--vh', `${vh}px`);
+
+    // Force layout recalculation
+    const chatContainer = document.querySelector('.chat-container');
+    if (chatContainer) {
+        chatContainer.style.height = `${window.innerHeight}px`;
+    }
+}
+
+// Debounce resize events
+let resizeTimeout;
+function debouncedHandleViewport() {
+    clearTimeout(resizeTimeout);
+    resizeTimeout = setTimeout(handleViewport, 100);
+}
+
+window.addEventListener('resize', debouncedHandleViewport);
+window.addEventListener('orientationchange', () => {
+    setTimeout(handleViewport, 300); // Delay for orientation change
+});
+handleViewport();
+
+// Add welcome message
+setTimeout(() => {
+    addMessage("Hello! I'm your AI assistant powered by DeepSeek. How can I help you today?", false);
+}, 500);
+
+// Cache the app shell for instant repeat visits; the worker is versioned by the server
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/sw.js').catch((e) => console.warn('Service worker not registered:', e));
+    });
+}
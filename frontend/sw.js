@@ -0,0 +1,65 @@
+// Service worker for the app shell. The server fills in PRECACHE and VERSION when it loads the
+// frontend; VERSION is a hash of every precached file, so any change to one installs a new worker
+// and a fresh cache.
+const VERSION = '__VERSION__';
+const PRECACHE = __PRECACHE__;
+const CACHE_NAME = `chatbot-${VERSION}`;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then((cache) => cache.addAll(PRECACHE))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((names) => Promise.all(
+                names.filter((name) => name.startsWith('chatbot-') && name !== CACHE_NAME)
+                    .map((name) => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Fingerprinted files never change: answer from the cache, filling it on a miss
+async function cacheFirst(request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.status === 200) cache.put(request, response.clone());
+    return response;
+}
+
+// The page and other unversioned files: answer from the cache at once and refresh it in the background
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(event.request);
+    const refresh = fetch(event.request).then((response) => {
+        if (response.status === 200) return cache.put(event.request, response.clone()).then(() => response);
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    // Chat, jobs, metrics and anything else dynamic always go to the network
+    if (request.method !== 'GET' || url.origin !== self.location.origin || request.headers.has('range')) return;
+    if (url.pathname.startsWith('/api/') || url.pathname.startsWith('/ws/') || url.pathname === '/metrics' ||
+        url.pathname === '/health' || url.pathname === '/sw.js') return;
+
+    if (url.pathname.startsWith('/assets/')) {
+        event.respondWith(cacheFirst(request));
+    } else {
+        event.respondWith(staleWhileRevalidate(event));
+    }
+});
@@ -0,0 +1,133 @@
+import argparse
+import base64
+import io
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageFilter, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger("chat")
+
+# Widths the background is resized to; only ones narrower than the original are produced
+BACKGROUND_WIDTHS = (480, 768, 1280, 1920, 2560)
+# (extension, media type, Pillow format, save options), most preferred first
+FORMATS = (
+    ("avif", "image/avif", "AVIF", {"quality": 50, "speed": 6}),
+    ("webp", "image/webp", "WEBP", {"quality": 72, "method": 6}),
+    ("jpg", "image/jpeg", "JPEG", {"quality": 78, "optimize": True, "progressive": True}),
+)
+PLACEHOLDER_WIDTH = 32
+# The background is dimmed behind the chat, so density beyond this isn't visible
+MAX_DPR = 1.5
+# Client hints the page asks for so image requests can be matched to the screen
+CLIENT_HINTS = "Sec-CH-Viewport-Width, Sec-CH-Viewport-Height, Sec-CH-DPR"
+IMAGE_VARY = "Accept, Sec-CH-Viewport-Width, Sec-CH-Viewport-Height, Sec-CH-DPR"
+
+
+def variant_name(name: str, width: int, ext: str) -> str:
+    """e.g. background-1280w.webp"""
+    return f"{os.path.splitext(name)[0]}-{width}w.{ext}"
+
+
+def supported_formats() -> List[tuple]:
+    if Image is None:
+        return []
+    return [fmt for fmt in FORMATS if fmt[0] == "jpg" or features.check(fmt[0])]
+
+
+def encode_variants(name: str, body: bytes, widths=BACKGROUND_WIDTHS) -> Dict[str, bytes]:
+    """Resized copies of an image in every supported format, keyed by variant_name()"""
+    variants: Dict[str, bytes] = {}
+    with Image.open(io.BytesIO(body)) as original:
+        image = original.convert("RGB")
+    for width in widths:
+        if width >= image.width:
+            continue
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for ext, _, fmt, options in supported_formats():
+            out = io.BytesIO()
+            resized.save(out, fmt, **options)
+            variants[variant_name(name, width, ext)] = out.getvalue()
+    return variants
+
+
+def encode_placeholder(body: bytes) -> bytes:
+    """A tiny blurred JPEG small enough to inline in the stylesheet"""
+    with Image.open(io.BytesIO(body)) as original:
+        image = original.convert("RGB")
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    image = image.resize((PLACEHOLDER_WIDTH, height), Image.BILINEAR).filter(ImageFilter.GaussianBlur(2))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=40)
+    return out.getvalue()
+
+
+def data_uri(body: bytes, media_type: str) -> str:
+    return f"data:{media_type};base64,{base64.b64encode(body).decode('ascii')}"
+
+
+def image_size(body: bytes) -> Optional[Tuple[int, int]]:
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None
+
+
+def parse_hint(value: Optional[str]) -> Optional[float]:
+    try:
+        number = float(value) if value else None
+    except ValueError:
+        return None
+    return number if number and number > 0 else None
+
+
+def target_width(headers, aspect: float) -> Optional[float]:
+    """Device pixels of image width needed to cover the viewport, from client hints; None without them"""
+    viewport_width = parse_hint(headers.get("sec-ch-viewport-width") or headers.get("viewport-width"))
+    if viewport_width is None:
+        return None
+    dpr = min(parse_hint(headers.get("sec-ch-dpr") or headers.get("dpr")) or 1.0, MAX_DPR)
+    # background-size: cover scales to whichever side needs more; a portrait phone needs the height
+    viewport_height = parse_hint(headers.get("sec-ch-viewport-height")) or 0.0
+    return max(viewport_width, viewport_height * aspect) * dpr
+
+
+def is_pre_encoded(path: str) -> bool:
+    directory, name = os.path.split(path)
+    return os.path.exists(os.path.join(directory, variant_name(name, PLACEHOLDER_WIDTH, "jpg")))
+
+
+def write_variants(path: str) -> Dict[str, int]:
+    """Encode the variants and placeholder of an image and write them next to it; returns their sizes"""
+    with open(path, "rb") as f:
+        body = f.read()
+    directory, name = os.path.split(path)
+    variants = encode_variants(name, body)
+    variants[variant_name(name, PLACEHOLDER_WIDTH, "jpg")] = encode_placeholder(body)
+    for variant, data in variants.items():
+        with open(os.path.join(directory, variant), "wb") as f:
+            f.write(data)
+    return {variant: len(data) for variant, data in variants.items()}
+
+
+def main() -> None:
+    """Write the variants next to the original, so servers load them instead of encoding at startup"""
+    parser = argparse.ArgumentParser(description="Pre-encode responsive variants of the background image")
+    parser.add_argument("image", help="Path to background.jpg")
+    args = parser.parse_args()
+    if Image is None:
+        parser.error("Pillow is required: pip install Pillow")
+
+    for variant, size in sorted(write_variants(args.image).items()):
+        print(f"{variant}: {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
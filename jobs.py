@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger("chat")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """One generation run in the background; tokens are kept so clients can resume from any offset"""
+
+    def __init__(self, message: str, conversation_id: str, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.message = message
+        self.conversation_id = conversation_id
+        # Client the job's token usage is charged to; only needed by the process running it
+        self.owner = ""
+        self.status = QUEUED
+        self.tokens: List[str] = []
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def notify(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def wait(self) -> None:
+        """Wait for the next token or status change"""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        await self._changed.wait()
+
+    def to_dict(self, offset: int = 0) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "conversation_id": self.conversation_id,
+            "content": "".join(self.tokens[offset:]),
+            "offset": len(self.tokens),
+            "error": self.error,
+        }
+
+
+class MemoryJobBackend:
+    """In-process store keeping the most recent max_jobs jobs for up to ttl seconds after they finish"""
+
+    blocking = False
+
+    def __init__(self, max_jobs: int, ttl: float):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.finished and job.updated_at + self.ttl < time.time():
+            del self._jobs[job_id]
+            return None
+        return job
+
+    def save(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def close(self) -> None:
+        self._jobs.clear()
+
+
+class SQLiteJobBackend:
+    """Jobs in a local SQLite file, so results survive restarts and are visible to every worker process
+
+    A running job is checkpointed periodically; one whose checkpoint is older than stale_after
+    belonged to a process that died, and is reported as failed.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_jobs: int, ttl: float, stale_after: float):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, message TEXT NOT NULL, conversation_id TEXT NOT NULL, "
+            "tokens TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, message, conversation_id, tokens, error, created_at, updated_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = Job(row[1], row[2], job_id)
+        job.status, job.tokens, job.error = row[0], json.loads(row[3]), row[4]
+        job.created_at, job.updated_at = row[5], row[6]
+        now = time.time()
+        if job.finished and job.updated_at + self.ttl < now:
+            return None
+        if job.status == RUNNING and job.updated_at + self.stale_after < now:
+            job.status = FAILED
+            job.error = "The job was interrupted. Please submit it again."
+        return job
+
+    def save(self, job: Job) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, message, conversation_id, tokens, error, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.status, job.message, job.conversation_id, json.dumps(job.tokens, ensure_ascii=False),
+                 job.error, job.created_at, job.updated_at),
+            )
+            if job.finished:
+                self._db.execute("DELETE FROM jobs WHERE updated_at < ? AND status IN (?, ?)",
+                                 (now - self.ttl, DONE, FAILED))
+                self._db.execute(
+                    "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_jobs,),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JobQueue:
+    """Bounded queue of jobs run by a fixed pool of worker tasks, independent of any client connection"""
+
+    def __init__(self, backend, generate: Callable[[Job], AsyncIterator[str]], workers: int,
+                 max_queued: int, checkpoint_interval: float, poll_interval: float):
+        self.backend = backend
+        self.generate = generate
+        self.checkpoint_interval = checkpoint_interval
+        self.poll_interval = poll_interval
+        self.queue: "asyncio.Queue[Job]" = asyncio.Queue(max_queued)
+        # Jobs queued or running in this process; the live objects, not checkpoints
+        self.active: Dict[str, Job] = {}
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    async def submit(self, job: Job) -> bool:
+        """Queue a job; False means the queue is full"""
+        if self.queue.full():
+            return False
+        self.active[job.id] = job
+        # Saved before a worker can pick it up, so the queued row never overwrites a running one
+        await self._save(job)
+        await self.queue.put(job)
+        return True
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self.active.get(job_id)
+        if job is not None:
+            return job
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.backend.get, job_id)
+        return self.backend.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Wait for a job to progress, returning its latest state"""
+        if job.id in self.active:
+            try:
+                await asyncio.wait_for(job.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return job
+        # Running in another process: all we can see are its checkpoints
+        await asyncio.sleep(self.poll_interval)
+        return await self.get(job.id) or job
+
+    async def _save(self, job: Job) -> None:
+        job.updated_at = time.time()
+        if self.backend.blocking:
+            await asyncio.to_thread(self.backend.save, job)
+        else:
+            self.backend.save(job)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = RUNNING
+        await self._save(job)
+        job.notify()
+        checkpoint_at = time.monotonic() + self.checkpoint_interval
+        try:
+            async for token in self.generate(job):
+                job.tokens.append(token)
+                job.notify()
+                if time.monotonic() >= checkpoint_at:
+                    await self._save(job)
+                    checkpoint_at = time.monotonic() + self.checkpoint_interval
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "The job was cancelled by a server shutdown. Please submit it again."
+            raise
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job.id, e)
+            job.status = FAILED
+            job.error = str(e) or type(e).__name__
+        finally:
+            del self.active[job.id]
+            job.notify()
+            await asyncio.shield(self._save(job))
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self.backend.close()
+
+
+def create_job_queue(backend: str, generate: Callable[[Job], AsyncIterator[str]], workers: int, max_queued: int,
+                     max_jobs: int, ttl: float, sqlite_path: str, checkpoint_interval: float) -> JobQueue:
+    """Build a job queue over the store named by `backend` ("memory" or "sqlite")"""
+    if backend == "memory":
+        store = MemoryJobBackend(max_jobs, ttl)
+    elif backend == "sqlite":
+        store = SQLiteJobBackend(sqlite_path, max_jobs, ttl, stale_after=max(30.0, checkpoint_interval * 10))
+    else:
+        raise ValueError(f"Unknown job backend: {backend}")
+    return JobQueue(store, generate, workers, max_queued, checkpoint_interval, poll_interval=checkpoint_interval)
@@ -0,0 +1,120 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Minimal Prometheus text-format metrics. Everything runs on the event loop thread, so plain
+# integer/float updates are atomic with respect to each other and need no locks; observing a
+# value does a bisect and two additions without allocating.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.value = 0.0
+        self._children: Dict[Tuple[str, ...], "Counter"] = {}
+
+    def labels(self, *values) -> "Counter":
+        """Child for these label values; keep a reference to it on hot paths"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = Counter(self.name, self.documentation)
+        return child
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.labelnames:
+            return [(self.name, _format_labels(self.labelnames, key), child.value)
+                    for key, child in self._children.items()]
+        return [(self.name, "", self.value)]
+
+    def render(self, kind: str = "counter") -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {kind}"]
+        lines.extend(f"{name}{labels} {value:g}" for name, labels, value in self.samples())
+        return lines
+
+
+class Gauge(Counter):
+    """Settable value, or a callback evaluated at scrape time"""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float] = None):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self.callback is not None:
+            return [(self.name, "", float(self.callback()))]
+        return super().samples()
+
+    def render(self, kind: str = "gauge") -> List[str]:
+        return super().render(kind)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum:g}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, callback))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
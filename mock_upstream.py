@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import AsyncGenerator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Local OpenAI-compatible streaming server, so routing and streaming can be exercised with no
+# network access. Point the chat app at it with
+#   UPSTREAMS='[{"name": "mock", "base_url": "http://127.0.0.1:9001/v1", "model": "mock"}]'
+
+WORDS = "The quick brown fox jumps over the lazy dog while the cat watches from the warm windowsill".split()
+
+
+class MockSettings:
+    ttft = 0.2
+    token_interval = 0.02
+    tokens = 50
+    # Up to this many seconds of extra random delay before the first token and between tokens
+    jitter = 0.0
+    # Fraction of requests answered with `error_status` instead of a stream
+    error_rate = 0.0
+    error_status = 500
+    # Fraction of streams whose connection is dropped halfway through
+    drop_rate = 0.0
+
+
+settings = MockSettings()
+app = FastAPI(title="Mock upstream")
+
+
+def chunk(model: str, content: str) -> bytes:
+    data = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def delay(base: float) -> float:
+    return base + random.uniform(0, settings.jitter) if settings.jitter else base
+
+
+async def generate(model: str, tokens: int, drop: bool) -> AsyncGenerator[bytes, None]:
+    yield b": OPENROUTER PROCESSING\n\n"
+    await asyncio.sleep(delay(settings.ttft))
+    for i in range(tokens):
+        if i:
+            await asyncio.sleep(delay(settings.token_interval))
+        if drop and i == tokens // 2:
+            raise ConnectionResetError("mock upstream dropped the stream")
+        yield chunk(model, ("" if i == 0 else " ") + WORDS[i % len(WORDS)])
+    yield b"data: [DONE]\n\n"
+
+
+@app.api_route("/v1/models", methods=["GET", "HEAD"])
+async def models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if settings.error_rate and random.random() < settings.error_rate:
+        return JSONResponse({"error": {"message": "injected error"}}, status_code=settings.error_status)
+    tokens = min(settings.tokens, body.get("max_tokens") or settings.tokens)
+    drop = bool(settings.drop_rate) and random.random() < settings.drop_rate
+    return StreamingResponse(generate(body.get("model", "mock"), tokens, drop), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible streaming upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=settings.ttft, help="seconds before the first token")
+    parser.add_argument("--token-interval", type=float, default=settings.token_interval, help="seconds between tokens")
+    parser.add_argument("--token-rate", type=float, help="tokens per second (overrides --token-interval)")
+    parser.add_argument("--tokens", type=int, default=settings.tokens, help="tokens per completion")
+    parser.add_argument("--jitter", type=float, default=settings.jitter, help="max extra random delay per token, seconds")
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=settings.error_status, help="HTTP status of injected errors")
+    parser.add_argument("--drop-rate", type=float, default=settings.drop_rate, help="fraction of streams cut midway")
+    args = parser.parse_args()
+    settings.ttft = args.ttft
+    settings.token_interval = 1 / args.token_rate if args.token_rate else args.token_interval
+    settings.tokens = args.tokens
+    settings.jitter = args.jitter
+    settings.error_rate = args.error_rate
+    settings.error_status = args.error_status
+    settings.drop_rate = args.drop_rate
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", backlog=16384)
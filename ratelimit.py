@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque
+
+
+class MemoryBucketStore:
+    """Token buckets kept in process, bounded to the most recently seen max_keys clients
+
+    Any object with the same take() method can stand in, e.g. one backed by a shared store.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, cost: float = 1) -> float:
+        """Spend cost tokens for key; return 0 if allowed, else seconds until enough are available
+
+        A cost above the burst is allowed from a full bucket and leaves it in debt, so it is
+        charged in full without being impossible.
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        needed = min(cost, self.burst)
+        if tokens >= needed:
+            tokens -= cost
+            wait = 0.0
+        else:
+            wait = (needed - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """Global cap on concurrent streams with a bounded FIFO wait queue"""
+
+    def __init__(self, max_active: int, max_waiting: int, timeout: float):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        """Take a stream slot, waiting up to timeout; False means the server is saturated"""
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_waiting:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # The slot was handed over just as the deadline passed
+                return True
+            self._abandon(waiter)
+            return False
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        """Hand the slot to the oldest live waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
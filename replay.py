@@ -0,0 +1,144 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncGenerator, AsyncIterator, Callable, List, Optional
+
+
+class StreamGone(Exception):
+    """The frames a reader asked for have already left the ring buffer"""
+
+
+def parse_last_event_id(value: Optional[str], stream_id: str) -> int:
+    """Sequence number from a "<stream id>:<seq>" Last-Event-ID; 0 (replay everything) if absent or for another stream"""
+    if not value:
+        return 0
+    prefix, _, seq = value.strip().rpartition(":")
+    if prefix != stream_id or not seq.isdigit():
+        return 0
+    return int(seq)
+
+
+# How long a new stream waits for its first reader, whatever the grace
+FIRST_READER_TIMEOUT = 10.0
+
+
+class ReplayStream:
+    """One response pumped into a bounded ring buffer of numbered frames that readers follow by event ID
+
+    The generation outlives its readers by `grace` seconds, so a client that drops and reconnects
+    with Last-Event-ID picks up where it left off instead of starting a new upstream request.
+    With no grace it is cancelled as soon as the last reader leaves.
+    `on_done` runs once the generation has finished or been cancelled, however few readers it had.
+    """
+
+    def __init__(self, stream_id: str, source: AsyncIterator[bytes], max_frames: int, grace: float,
+                 on_done: Optional[Callable[[], None]] = None):
+        self.id = stream_id
+        self.max_frames = max_frames
+        self.grace = grace
+        # frames[i] has sequence number first_seq + i; trimmed in batches so appends stay O(1)
+        self.frames: List[bytes] = []
+        self.first_seq = 1
+        self.done = False
+        self.finished_at = 0.0
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+        if on_done is not None:
+            # A done callback also fires for a task cancelled before _pump ever ran
+            self.task.add_done_callback(lambda _: on_done())
+        # Also covers a response that never starts reading
+        self._expiry: Optional[asyncio.TimerHandle] = asyncio.get_running_loop().call_later(
+            max(grace, FIRST_READER_TIMEOUT), self.task.cancel)
+
+    @property
+    def last_seq(self) -> int:
+        return self.first_seq + len(self.frames) - 1
+
+    async def _pump(self, source: AsyncIterator[bytes]) -> None:
+        try:
+            async for chunk in source:
+                # Coalesced or replayed chunks can hold several events; each gets its own ID
+                for event in chunk.split(b"\n\n"):
+                    if event:
+                        self.frames.append(event + b"\n\n")
+                if len(self.frames) > self.max_frames * 2:
+                    drop = len(self.frames) - self.max_frames
+                    del self.frames[:drop]
+                    self.first_seq += drop
+                self._notify()
+        finally:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._notify()
+            if hasattr(source, "aclose"):
+                await source.aclose()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def frame_id(self, seq: int) -> bytes:
+        return f"id: {self.id}:{seq}\n".encode("ascii")
+
+    def check(self, after: int) -> None:
+        """Raise StreamGone if a reader that has seen `after` can no longer be served every frame it missed"""
+        if after + 1 < self.first_seq or after > self.last_seq:
+            raise StreamGone(self.id)
+
+    async def follow(self, after: int = 0) -> AsyncGenerator[bytes, None]:
+        """Frames after sequence number `after` in one write, then the live tail"""
+        self.readers += 1
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        try:
+            while True:
+                if after < self.last_seq:
+                    if after + 1 < self.first_seq:
+                        # Fell further behind than the buffer holds; let the client start over
+                        return
+                    start = after + 1 - self.first_seq
+                    yield b"".join(self.frame_id(self.first_seq + i) + frame
+                                   for i, frame in enumerate(self.frames[start:], start))
+                    after = self.last_seq
+                elif self.done:
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.done:
+                self._expiry = asyncio.get_running_loop().call_later(self.grace, self.task.cancel)
+
+
+class ReplayStore:
+    """Recent response streams by ID, each kept for `ttl` seconds after it finishes"""
+
+    def __init__(self, max_streams: int, max_frames: int, ttl: float, grace: float):
+        self.max_streams = max_streams
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.grace = grace
+        self._streams: "OrderedDict[str, ReplayStream]" = OrderedDict()
+
+    def start(self, source: AsyncIterator[bytes], on_done: Optional[Callable[[], None]] = None) -> ReplayStream:
+        self._evict()
+        stream = ReplayStream(uuid.uuid4().hex, source, self.max_frames, self.grace, on_done)
+        self._streams[stream.id] = stream
+        return stream
+
+    def get(self, stream_id: str) -> Optional[ReplayStream]:
+        self._evict()
+        return self._streams.get(stream_id)
+
+    def _evict(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        while self._streams:
+            oldest = next(iter(self._streams.values()))
+            expired = oldest.done and oldest.finished_at < cutoff
+            if not expired and len(self._streams) < self.max_streams:
+                break
+            # Dropping a live stream only forgets it for resumption; its current readers keep going
+            del self._streams[oldest.id]
@@ -0,0 +1,198 @@
+import asyncio
+import importlib
+import logging
+import os
+import re
+import threading
+import zlib
+from typing import Callable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("chat")
+
+# Embed-and-match layer over the response cache: paraphrases of a cached prompt map to its cache key.
+# Vectors are unit length, so cosine similarity is a single matrix-vector product over the index.
+
+Embedder = Callable[[Sequence[str]], "np.ndarray"]
+
+WORD_RE = re.compile(r"\w+")
+
+# Hashed words can't tell "with alcohol" from "without alcohol" (0.89), so with the hashing embedder
+# only near-verbatim repeats (case, spacing, punctuation) are allowed to match
+HASHING_MIN_THRESHOLD = 0.98
+
+
+def hashing_embedder(dim: int = 384) -> Embedder:
+    """Feature-hashed words and character trigrams; no model needed, stable across processes"""
+
+    def embed(texts: Sequence[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in WORD_RE.findall(text.casefold()):
+                padded = f" {word} "
+                features = [word] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+                for feature in features:
+                    h = zlib.crc32(feature.encode("utf-8"))
+                    # Whole words count double: they carry more meaning than trigrams
+                    weight = 2.0 if feature is word else 1.0
+                    vectors[row, h % dim] += weight if h & 0x80000000 else -weight
+        return normalize(vectors)
+
+    return embed
+
+
+def sentence_transformer_embedder(model_name: str) -> Embedder:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+
+    def embed(texts: Sequence[str]) -> "np.ndarray":
+        return normalize(np.asarray(model.encode(list(texts), batch_size=32), dtype=np.float32))
+
+    return embed
+
+
+def load_embedder(spec: str) -> Tuple[Embedder, bool]:
+    """"hashing", a "module:function" returning an Embedder, or a sentence-transformers model name
+
+    Returns the embedder and whether it is the hashing one.
+    """
+    if not spec or spec == "hashing":
+        return hashing_embedder(), True
+    if ":" in spec:
+        module, _, name = spec.partition(":")
+        return getattr(importlib.import_module(module), name)(), False
+    try:
+        return sentence_transformer_embedder(spec), False
+    except (ImportError, OSError) as exc:
+        logger.warning("Can't load sentence-transformers model %r (%s); falling back to the hashing embedder, "
+                       "which only matches near-verbatim repeats", spec, exc)
+        return hashing_embedder(), True
+
+
+def normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class SemanticIndex:
+    """Fixed-size ring of (vector, cache key) rows; the oldest row is overwritten once it is full
+
+    With a path, the rows live in memory-mapped .npy files that every worker process maps and
+    searches directly; writers serialize on a lock file.
+    """
+
+    def __init__(self, dim: int, max_entries: int, path: str = ""):
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._lock_file = None
+        if path:
+            self.vectors = self._open(f"{path}.vectors.npy", np.float32, (max_entries, dim))
+            self.keys = self._open(f"{path}.keys.npy", "S64", (max_entries,))
+            # Total rows ever written; the next slot is head % max_entries
+            self.head = self._open(f"{path}.head.npy", np.int64, (1,))
+            self._lock_file = open(f"{path}.lock", "a")
+        else:
+            self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+            self.keys = np.zeros(max_entries, dtype="S64")
+            self.head = np.zeros(1, dtype=np.int64)
+
+    @staticmethod
+    def _open(path: str, dtype, shape) -> "np.ndarray":
+        if os.path.exists(path):
+            existing = np.lib.format.open_memmap(path, mode="r+")
+            if existing.shape == shape and existing.dtype == np.dtype(dtype):
+                return existing
+            logger.warning("Semantic index %s has a different shape or dtype; recreating it", path)
+            del existing
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    def __len__(self) -> int:
+        return int(min(self.head[0], self.max_entries))
+
+    def search(self, queries: "np.ndarray", threshold: float) -> List[Optional[str]]:
+        """Cache key of the nearest row for each query row, or None if nothing reaches threshold"""
+        count = len(self)
+        if not count:
+            return [None] * len(queries)
+        scores = queries @ self.vectors[:count].T
+        best = scores.argmax(axis=1)
+        results = []
+        for row, index in enumerate(best):
+            key = self.keys[index]
+            # An empty key marks a row that is being rewritten
+            results.append(key.decode("ascii") if key and scores[row, index] >= threshold else None)
+        return results
+
+    def add(self, vector: "np.ndarray", key: str) -> None:
+        with self._lock:
+            if self._lock_file is not None and fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                slot = int(self.head[0] % self.max_entries)
+                # Readers skip rows with an empty key, so clear it before the vector changes
+                self.keys[slot] = b""
+                self.vectors[slot] = vector
+                self.keys[slot] = key.encode("ascii")
+                self.head[0] += 1
+            finally:
+                if self._lock_file is not None and fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        for array in (self.vectors, self.keys, self.head):
+            if isinstance(array, np.memmap):
+                array.flush()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+
+class SemanticCache:
+    """Map a message to the cache key of a previously answered message that means the same thing"""
+
+    def __init__(self, embed: Embedder, threshold: float, max_entries: int, path: str = ""):
+        self.embed = embed
+        self.threshold = threshold
+        dim = embed(["dimension probe"]).shape[1]
+        self.index = SemanticIndex(dim, max_entries, path)
+
+    def _lookup(self, messages: Sequence[str]) -> List[Optional[str]]:
+        return self.index.search(self.embed(messages), self.threshold)
+
+    async def lookup(self, message: str) -> Optional[str]:
+        # Embedding and the matrix product are CPU-bound and release the GIL in NumPy
+        return (await asyncio.to_thread(self._lookup, [message]))[0]
+
+    def _add(self, message: str, key: str) -> None:
+        self.index.add(self.embed([message])[0], key)
+
+    async def add(self, message: str, key: str) -> None:
+        await asyncio.to_thread(self._add, message, key)
+
+    def close(self) -> None:
+        self.index.close()
+
+
+def create_semantic_cache(enabled: bool, embedder: str, threshold: float, max_entries: int,
+                          path: str) -> Optional[SemanticCache]:
+    if not enabled:
+        return None
+    if np is None:
+        logger.warning("NumPy is not installed; the semantic cache is disabled")
+        return None
+    embed, hashing = load_embedder(embedder)
+    if hashing and threshold < HASHING_MIN_THRESHOLD:
+        logger.warning("Raising the semantic cache threshold from %s to %s for the hashing embedder",
+                       threshold, HASHING_MIN_THRESHOLD)
+        threshold = HASHING_MIN_THRESHOLD
+    return SemanticCache(embed, threshold, max_entries, path)
@@ -0,0 +1,165 @@
+import argparse
+import importlib.util
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import List, Optional
+
+import uvicorn
+
+# Production launcher: N worker processes on one port. On SIGTERM every worker stops accepting,
+# closes idle keep-alive connections and lets in-flight streams finish within the drain deadline;
+# whatever is still running after that is cancelled so the client gets a clean end of stream.
+#   python serve.py --workers 4 --drain-timeout 30
+
+logger = logging.getLogger("chat")
+
+APP = "chat:create_app"
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def build_config(args: argparse.Namespace) -> uvicorn.Config:
+    return uvicorn.Config(
+        APP,
+        factory=True,
+        host=args.host,
+        port=args.port,
+        loop=event_loop(),
+        http=http_protocol(),
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.drain_timeout,
+        timeout_keep_alive=args.keep_alive,
+    )
+
+
+def pre_encode_images() -> None:
+    """Write the background's variants once here, instead of every worker encoding them at startup"""
+    import images
+    from chat import ASSET_DIR
+
+    path = os.path.join(ASSET_DIR, "background.jpg")
+    if images.Image is None or not os.path.exists(path) or images.is_pre_encoded(path):
+        return
+    try:
+        sizes = images.write_variants(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not pre-encode %s (%s); each worker will encode it at startup", path, e)
+        return
+    logger.info("Pre-encoded %d variants of %s", len(sizes), path)
+
+
+def run_worker(args: argparse.Namespace, sock: Optional[socket.socket]) -> None:
+    """Serve on the shared listening socket, or bind our own with SO_REUSEPORT"""
+    if sock is None:
+        sock = bind_socket(args.host, args.port, reuse_port=True)
+    uvicorn.Server(build_config(args)).run(sockets=[sock])
+
+
+class Supervisor:
+    """Start the workers, restart any that crash, and forward shutdown signals to all of them"""
+
+    def __init__(self, args: argparse.Namespace, sock: Optional[socket.socket]):
+        self.args = args
+        self.sock = sock
+        self.context = multiprocessing.get_context("spawn")
+        self.workers: List[multiprocessing.Process] = []
+        self.stopping = False
+
+    def spawn(self) -> multiprocessing.Process:
+        worker = self.context.Process(target=run_worker, args=(self.args, self.sock), daemon=False)
+        worker.start()
+        return worker
+
+    def handle_signal(self, signum, frame) -> None:
+        if not self.stopping:
+            logger.info("Received %s, draining %d workers", signal.Signals(signum).name, len(self.workers))
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        self.workers = [self.spawn() for _ in range(self.args.workers)]
+        logger.info("Started %d workers (loop=%s, http=%s, reuse_port=%s)",
+                    len(self.workers), event_loop(), http_protocol(), self.sock is None)
+
+        while not self.stopping:
+            for i, worker in enumerate(self.workers):
+                if not worker.is_alive() and not self.stopping:
+                    logger.warning("Worker %s exited with code %s, restarting", worker.pid, worker.exitcode)
+                    self.workers[i] = self.spawn()
+            time.sleep(0.5)
+
+        # Drop our copy of the listening socket so it closes as soon as the workers close theirs
+        if self.sock is not None:
+            self.sock.close()
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        # Workers cancel what's left at the drain deadline; allow a little longer for them to unwind
+        deadline = time.monotonic() + self.args.drain_timeout + 5
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive():
+                logger.error("Worker %s did not exit after draining, killing it", worker.pid)
+                worker.kill()
+                worker.join()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the chat server with multiple workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--reuse-port", action="store_true", default=os.getenv("REUSE_PORT", "0") == "1",
+                        help="give each worker its own SO_REUSEPORT socket so the kernel balances connections")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("DRAIN_TIMEOUT", "30")),
+                        help="seconds in-flight streams get to finish after SIGTERM")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE_TIMEOUT", "5")),
+                        help="seconds an idle client connection is kept open")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(message)s")
+    if args.reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+        logger.warning("SO_REUSEPORT is not supported on this platform, sharing one socket")
+        args.reuse_port = False
+    pre_encode_images()
+    if args.workers <= 1:
+        uvicorn.Server(build_config(args)).run()
+        return
+    # Bind in the parent so a port conflict fails fast, even when workers bind their own sockets
+    sock = bind_socket(args.host, args.port, args.reuse_port)
+    if args.reuse_port:
+        # Each worker binds its own socket; keeping ours open would receive a share of connections
+        sock.close()
+        sock = None
+    Supervisor(args, sock).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import asyncio
+import json
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
+
+# Optional faster JSON backends: msgspec decodes only the fields we read, orjson parses and
+# serializes straight to bytes, and the standard library is the fallback.
+try:
+    import msgspec
+
+    class _Delta(msgspec.Struct):
+        content: Optional[str] = None
+
+    class _Choice(msgspec.Struct):
+        delta: _Delta = msgspec.field(default_factory=_Delta)
+
+    class _Chunk(msgspec.Struct):
+        choices: List[_Choice] = []
+
+    class _Usage(msgspec.Struct):
+        prompt_tokens: int = 0
+        completion_tokens: int = 0
+
+    class _UsageChunk(msgspec.Struct):
+        usage: Optional[_Usage] = None
+
+    _chunk_decoder = msgspec.json.Decoder(_Chunk)
+    _usage_decoder = msgspec.json.Decoder(_UsageChunk)
+    _encoder = msgspec.json.Encoder()
+    JSON_BACKEND = "msgspec"
+    DecodeError = msgspec.MsgspecError
+
+    def extract_content(data: bytes) -> Optional[str]:
+        """Return choices[0].delta.content from an OpenAI-style stream chunk"""
+        chunk = _chunk_decoder.decode(data)
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def extract_usage(data: bytes) -> Optional[Tuple[int, int]]:
+        """Return (prompt_tokens, completion_tokens) from a chunk's usage field, if it has one"""
+        usage = _usage_decoder.decode(data).usage
+        return (usage.prompt_tokens, usage.completion_tokens) if usage is not None else None
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj)
+
+except ImportError:
+    try:
+        import orjson
+        _loads = orjson.loads
+        dumps = orjson.dumps
+        JSON_BACKEND = "orjson"
+    except ImportError:
+        _loads = json.loads
+        JSON_BACKEND = "json"
+
+        def dumps(obj) -> bytes:
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    DecodeError = ValueError
+
+    def extract_content(data: bytes) -> Optional[str]:
+        """Return choices[0].delta.content from an OpenAI-style stream chunk"""
+        choices = _loads(data).get("choices")
+        if not choices:
+            return None
+        return (choices[0].get("delta") or {}).get("content")
+
+    def extract_usage(data: bytes) -> Optional[Tuple[int, int]]:
+        """Return (prompt_tokens, completion_tokens) from a chunk's usage field, if it has one"""
+        usage = _loads(data).get("usage")
+        if not usage:
+            return None
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+
+
+def encode_event(data: dict) -> bytes:
+    """Frame one SSE data event"""
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+class SSEParser:
+    """Incremental text/event-stream parser working on raw bytes"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Consume a chunk and return the data payloads of every event it completes"""
+        if b"\n" not in chunk:
+            self._buffer += chunk
+            return []
+        lines = (self._buffer + chunk).split(b"\n")
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if not line:
+                if self._data:
+                    events.append(b"\n".join(self._data))
+                    self._data = []
+            elif line.startswith(b"data:"):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(b" ") else value)
+            # Comments (": keep-alive") and event/id/retry fields carry nothing we use
+        return events
+
+    def close(self) -> List[bytes]:
+        """Flush an event left unterminated at end of stream"""
+        events = self.feed(b"\n\n") if self._buffer or self._data else []
+        self._buffer = b""
+        return events
+
+
+async def iter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+    """Yield each event's data payload until the [DONE] sentinel or end of stream"""
+    parser = SSEParser()
+    async for chunk in chunks:
+        for data in parser.feed(chunk):
+            if data == b"[DONE]":
+                return
+            yield data
+    for data in parser.close():
+        if data == b"[DONE]":
+            return
+        yield data
+
+
+async def batch_tokens(tokens: AsyncIterator[str], max_tokens: int, max_bytes: int,
+                       interval: float) -> AsyncGenerator[str, None]:
+    """Merge tokens into batches flushed after max_tokens, max_bytes or interval seconds
+
+    The first token is always passed through on its own so time-to-first-token is unchanged.
+    """
+    iterator = tokens.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return
+    yield first
+    if max_tokens <= 1:
+        async for token in iterator:
+            yield token
+        return
+
+    loop = asyncio.get_running_loop()
+    pending: List[str] = []
+    size = 0
+    deadline = 0.0
+    next_token = None
+    try:
+        while True:
+            if pending:
+                # Wait for the next token only until the oldest buffered one is due
+                if next_token is None:
+                    next_token = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait((next_token,), timeout=max(deadline - loop.time(), 0))
+                if not done:
+                    yield "".join(pending)
+                    pending, size = [], 0
+                    continue
+            try:
+                if next_token is not None:
+                    future, next_token = next_token, None
+                    token = await future
+                else:
+                    token = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            if not pending:
+                deadline = loop.time() + interval
+
+            pending.append(token)
+            size += len(token.encode("utf-8"))
+            if len(pending) >= max_tokens or size >= max_bytes:
+                yield "".join(pending)
+                pending, size = [], 0
+    finally:
+        if next_token is not None:
+            next_token.cancel()
+
+    if pending:
+        yield "".join(pending)
+
+
+async def idle_timeout(tokens: AsyncIterator[str], timeout: float) -> AsyncGenerator[str, None]:
+    """Pass tokens through, raising TimeoutError if none arrives within timeout seconds of the last"""
+    loop = asyncio.get_running_loop()
+    iterator = tokens.__aiter__()
+    while True:
+        task = asyncio.current_task()
+        expired = False
+
+        def expire() -> None:
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        handle = loop.call_later(timeout, expire)
+        try:
+            token = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        except asyncio.CancelledError:
+            if not expired:
+                raise
+            task.uncancel()
+            raise TimeoutError(f"No tokens for {timeout:g}s")
+        finally:
+            handle.cancel()
+        yield token
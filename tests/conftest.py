@@ -0,0 +1,66 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mock_upstream():
+    """Start mock_upstream.py servers with the given options; returns each one's base URL"""
+    processes = []
+
+    def start(**options) -> str:
+        port = free_port()
+        args = [sys.executable, os.path.join(ROOT, "mock_upstream.py"), "--port", str(port)]
+        for name, value in options.items():
+            args += [f"--{name.replace('_', '-')}", str(value)]
+        processes.append(subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        base_url = f"http://127.0.0.1:{port}/v1"
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                httpx.get(f"{base_url}/models", timeout=0.5)
+                return base_url
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("mock upstream did not start")
+                time.sleep(0.05)
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=5)
+
+
+@pytest.fixture
+def app_client(mock_upstream, monkeypatch):
+    """The real app with its routes, with the mock as its only upstream"""
+    from fastapi.testclient import TestClient
+
+    import chat
+    from test_routing import make_router
+
+    monkeypatch.setattr(chat, "RATE_LIMIT_RPS", 0)
+    monkeypatch.setattr(chat, "UPSTREAM_WARMUP", False)
+    base_url = mock_upstream(ttft=0, token_interval=0, tokens=3)
+    with TestClient(chat.create_app()) as client:
+        client.app.state.router = make_router(base_url)
+        yield client
@@ -0,0 +1,48 @@
+import pytest
+
+from assets import etag_matches, parse_range
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=100-", 100) is None
+    assert parse_range("bytes=-0", 100) is None
+
+
+def test_parse_range_rejects_what_it_does_not_handle():
+    with pytest.raises(ValueError):
+        parse_range("bytes=0-1,5-6", 100)
+    with pytest.raises(ValueError):
+        parse_range("items=0-1", 100)
+
+
+def test_etag_matches_uses_weak_comparison():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc", "def"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+
+
+def test_pre_encoded_variants_are_loaded_without_encoding(tmp_path, monkeypatch, caplog):
+    images = pytest.importorskip("images")
+    Image = pytest.importorskip("PIL.Image")
+    from assets import AssetStore
+
+    path = tmp_path / "background.jpg"
+    Image.new("RGB", (1000, 600), "navy").save(path, "JPEG")
+    assert not images.is_pre_encoded(str(path))
+    sizes = images.write_variants(str(path))
+    assert "background-480w.jpg" in sizes and "background-32w.jpg" in sizes
+    assert images.is_pre_encoded(str(path))
+
+    def fail(*args):
+        raise AssertionError("variants should have been read from disk")
+
+    monkeypatch.setattr(images, "encode_variants", fail)
+    monkeypatch.setattr(images, "encode_placeholder", fail)
+    image = AssetStore().load_responsive(str(path), "image/jpeg")
+    assert image is not None
+    assert "not pre-encoded" not in caplog.text
@@ -0,0 +1,113 @@
+import pytest
+
+import cache
+from cache import MemoryCacheBackend, SQLiteCacheBackend, create_response_cache, make_cache_key, normalize_message
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = time
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path):
+    backends = []
+
+    def make(max_entries=100, max_bytes=1000):
+        if request.param == "memory":
+            backend = MemoryCacheBackend(max_entries, max_bytes)
+        else:
+            backend = SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"), max_entries, max_bytes)
+        backends.append(backend)
+        return backend
+
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+def test_normalize_message_folds_case_space_and_trailing_punctuation():
+    assert normalize_message("  What is  SSE?\n") == "what is sse"
+    assert normalize_message("Hello!!") == "hello"
+    # Only trailing punctuation goes; inner punctuation can change the meaning
+    assert normalize_message("e.g. this?") == "e.g. this"
+
+
+def test_cache_key_covers_everything_that_changes_the_answer():
+    key = make_cache_key("m", "sys", 0.7, 100, "Hi there?")
+    assert key == make_cache_key("m", "sys", 0.7, 100, "hi  there")
+    assert key != make_cache_key("m", "sys", 0.7, 100, "Hi there?", normalize=False)
+    for changed in (("m2", "sys", 0.7, 100), ("m", "sys2", 0.7, 100), ("m", "sys", 0.2, 100), ("m", "sys", 0.7, 50)):
+        assert key != make_cache_key(*changed, "Hi there?")
+
+
+def test_entries_expire_after_ttl(make_backend, clock):
+    backend = make_backend()
+    backend.set("a", "answer", ttl=10)
+    clock.now += 9
+    assert backend.get("a") == "answer"
+    clock.now += 2
+    assert backend.get("a") is None
+
+
+def test_entry_limit_evicts_least_recently_used(make_backend, clock):
+    backend = make_backend(max_entries=2)
+    backend.set("a", "1", ttl=60)
+    clock.now += 1
+    backend.set("b", "2", ttl=60)
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert backend.get("a") == "1"
+    clock.now += 1
+    backend.set("c", "3", ttl=60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "1"
+    assert backend.get("c") == "3"
+
+
+def test_byte_budget_evicts_and_skips_oversized_values(make_backend, clock):
+    backend = make_backend(max_bytes=10)
+    backend.set("a", "aaaa", ttl=60)
+    clock.now += 1
+    backend.set("b", "bbbb", ttl=60)
+    clock.now += 1
+    backend.set("c", "cccc", ttl=60)
+    assert backend.get("a") is None
+    assert backend.get("b") == "bbbb" and backend.get("c") == "cccc"
+    backend.set("huge", "x" * 11, ttl=60)
+    assert backend.get("huge") is None
+    assert backend.get("c") == "cccc"
+
+
+def test_sqlite_cache_survives_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    backend = SQLiteCacheBackend(path, 10, 1000)
+    backend.set("a", "answer", ttl=60)
+    backend.close()
+    reopened = SQLiteCacheBackend(path, 10, 1000)
+    assert reopened.get("a") == "answer"
+    reopened.close()
+
+
+@pytest.mark.anyio
+async def test_response_cache_runs_either_backend(tmp_path):
+    for backend in ("memory", "sqlite"):
+        response_cache = create_response_cache(backend, 60, 10, 1000, str(tmp_path / "cache.sqlite3"))
+        await response_cache.set("k", "v")
+        assert await response_cache.get("k") == "v"
+        response_cache.close()
+    assert create_response_cache("none", 60, 10, 1000, "") is None
+    with pytest.raises(ValueError):
+        create_response_cache("redis", 60, 10, 1000, "")
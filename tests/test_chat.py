@@ -0,0 +1,194 @@
+import asyncio
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import chat
+from ratelimit import AdmissionController, MemoryBucketStore
+
+
+def make_request(api_key=None, host="203.0.113.7", app=None, forwarded=None) -> Request:
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    if forwarded:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    scope = {"type": "http", "method": "POST", "path": "/api/chat", "headers": headers, "client": (host, 1234)}
+    if app is not None:
+        scope["app"] = app
+    return Request(scope)
+
+
+def test_client_id_only_trusts_configured_keys(monkeypatch):
+    monkeypatch.setattr(chat, "API_KEYS", frozenset({"team-key"}))
+    assert chat.client_id(make_request("team-key")) == "key:team-key"
+    assert chat.client_id(make_request("made-up")) == "ip:203.0.113.7"
+    assert chat.client_id(make_request()) == "ip:203.0.113.7"
+
+
+def test_rotating_keys_do_not_escape_the_rate_limit(monkeypatch):
+    monkeypatch.setattr(chat, "API_KEYS", frozenset())
+    app = SimpleNamespace(state=SimpleNamespace(rate_limiter=MemoryBucketStore(rate=1, burst=2)))
+    for n in range(2):
+        chat.check_rate_limit(make_request(f"key-{n}", app=app))
+    with pytest.raises(HTTPException) as refused:
+        chat.check_rate_limit(make_request("key-2", app=app))
+    assert refused.value.status_code == 429
+
+
+def test_forged_forwarded_for_does_not_escape_the_rate_limit(monkeypatch):
+    monkeypatch.setattr(chat, "TRUST_PROXY_HEADERS", 1)
+    app = SimpleNamespace(state=SimpleNamespace(rate_limiter=MemoryBucketStore(rate=1, burst=2)))
+    # The client writes the left entries; our proxy appends the address it saw
+    for n in range(2):
+        request = make_request(app=app, host="10.0.0.2", forwarded=f"198.51.100.{n}, 203.0.113.7")
+        assert chat.client_id(request) == "ip:203.0.113.7"
+        chat.check_rate_limit(request)
+    with pytest.raises(HTTPException) as refused:
+        chat.check_rate_limit(make_request(app=app, host="10.0.0.2", forwarded="198.51.100.2, 203.0.113.7"))
+    assert refused.value.status_code == 429
+
+
+def test_forwarded_for_counts_trusted_hops(monkeypatch):
+    monkeypatch.setattr(chat, "TRUST_PROXY_HEADERS", 2)
+    assert chat.client_id(make_request(forwarded="1.1.1.1, 203.0.113.9, 10.0.0.5")) == "ip:203.0.113.9"
+    # Fewer entries than proxies: the header didn't come through them, so use the peer address
+    assert chat.client_id(make_request(host="10.0.0.2", forwarded="203.0.113.9")) == "ip:10.0.0.2"
+
+
+def test_every_path_caches_and_records_turns_alike(app_client):
+    state = app_client.app.state
+    first = app_client.post("/api/chat?stream=false", json={"message": "hello"}).json()
+    assert first["content"] == "The quick brown"
+    conversation = first["conversation_id"]
+
+    # A first turn is cached, so a stream elsewhere is served from it
+    streamed = app_client.post("/api/chat", json={"message": "hello"})
+    assert streamed.headers["X-Cache"] == "HIT"
+    # A follow-up depends on the history, so it is never looked up in the cache
+    followup = app_client.post("/api/chat", json={"message": "hello", "conversation_id": conversation})
+    assert "X-Cache" not in followup.headers
+
+    job = app_client.post("/api/jobs", json={"message": "again", "conversation_id": conversation}).json()
+    for _ in range(100):
+        polled = app_client.get(f"/api/jobs/{job['id']}").json()
+        if polled["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert polled["content"] == "The quick brown"
+
+    history = app_client.portal.call(state.conversations.history, conversation)
+    assert [turn["content"] for turn in history] == ["hello", "The quick brown"] * 2 + ["again", "The quick brown"]
+
+
+def test_joining_a_coalesced_stream_takes_no_admission_slot(app_client, mock_upstream, monkeypatch):
+    from test_routing import make_router
+
+    monkeypatch.setattr(chat, "COALESCE_REQUESTS", True)
+    state = app_client.app.state
+    state.router = make_router(mock_upstream(ttft=0.5, token_interval=0, tokens=3))
+    state.admission = AdmissionController(max_active=1, max_waiting=0, timeout=0)
+
+    async def open_same_prompt_twice():
+        first, _ = await chat.open_chat_stream(chat.ChatMessage(message="same"), make_request(app=app_client.app))
+        second, _ = await chat.open_chat_stream(chat.ChatMessage(message="same"), make_request(app=app_client.app))
+        active = state.admission.active
+        answers = [b"".join([chunk async for chunk in replay.follow()]) for replay in (first, second)]
+        return active, answers
+
+    active, (first, second) = app_client.portal.call(open_same_prompt_twice)
+    assert active == 1
+    assert b"quick" in first and b"quick" in second
+
+
+def read_first_frame_then_leave(app_client):
+    async def run():
+        replay, _ = await chat.open_chat_stream(chat.ChatMessage(message="tell me"), make_request(app=app_client.app))
+        reader = replay.follow()
+        await reader.__anext__()
+        await reader.aclose()
+        await asyncio.sleep(0.3)
+        return replay
+
+    return app_client.portal.call(run)
+
+
+def test_disconnect_cancels_the_generation_by_default(app_client, mock_upstream, monkeypatch):
+    from test_routing import make_router
+
+    monkeypatch.setattr(chat, "COALESCE_REQUESTS", False)
+    app_client.app.state.router = make_router(mock_upstream(ttft=0, token_interval=0.05, tokens=40))
+    assert app_client.app.state.replays.grace == 0
+    cancellations = chat.UPSTREAM_CANCELLATIONS.value
+    replay = read_first_frame_then_leave(app_client)
+    assert replay.task.done()
+    assert chat.UPSTREAM_CANCELLATIONS.value == cancellations + 1
+    assert replay.last_seq < 40
+    assert app_client.app.state.admission.active == 0
+
+
+def test_resume_grace_keeps_the_generation_running(app_client, mock_upstream, monkeypatch):
+    from test_routing import make_router
+
+    monkeypatch.setattr(chat, "COALESCE_REQUESTS", False)
+    app_client.app.state.router = make_router(mock_upstream(ttft=0, token_interval=0.05, tokens=40))
+    app_client.app.state.replays.grace = 5
+    replay = read_first_frame_then_leave(app_client)
+    assert not replay.task.done()
+    assert replay.last_seq > 1
+    replay.task.cancel()
+
+
+def counted_tokens():
+    return sum(chat.USAGE_TOKENS.labels(kind, source).value
+               for kind in ("prompt", "completion") for source in ("reported", "estimated"))
+
+
+def test_coalesced_generation_is_counted_once_but_charged_to_everyone(app_client, mock_upstream, monkeypatch):
+    from test_routing import make_router
+
+    monkeypatch.setattr(chat, "COALESCE_REQUESTS", True)
+    state = app_client.app.state
+    state.router = make_router(mock_upstream(ttft=0.3, token_interval=0, tokens=3))
+    before = counted_tokens()
+
+    async def two_clients_same_prompt():
+        replays = [(await chat.open_chat_stream(chat.ChatMessage(message="shared"),
+                                                make_request(host=host, app=app_client.app)))[0]
+                   for host in ("198.51.100.1", "198.51.100.2")]
+        for replay in replays:
+            [chunk async for chunk in replay.follow()]
+        await asyncio.sleep(0.1)
+
+    app_client.portal.call(two_clients_same_prompt)
+    first, second = (state.usage.daily.get(f"ip:198.51.100.{n}", 0) for n in (1, 2))
+    assert first and first == second
+    assert counted_tokens() - before == first
+
+
+def test_batch_answers_in_order_and_fails_per_item(app_client, monkeypatch):
+    prepare_turn = chat.prepare_turn
+
+    async def flaky(app, message, conversation_id):
+        if message == "bad":
+            raise sqlite3.OperationalError("database is locked")
+        return await prepare_turn(app, message, conversation_id)
+
+    monkeypatch.setattr(chat, "prepare_turn", flaky)
+    response = app_client.post("/api/chat/batch", json={"messages": [
+        {"message": "one"}, {"message": "bad", "conversation_id": "c1"}, {"message": " "},
+    ]})
+    assert response.status_code == 200
+    one, bad, empty = response.json()["results"]
+    assert one["content"] == "The quick brown" and one["error"] is None
+    assert bad == {"content": "", "error": "Unexpected error: database is locked", "conversation_id": "c1"}
+    assert empty["error"] == "Message cannot be empty"
+
+
+def test_batch_takes_a_rate_limit_token_per_message(app_client):
+    app_client.app.state.rate_limiter = MemoryBucketStore(rate=0.01, burst=3)
+    messages = [{"message": f"m{n}"} for n in range(2)]
+    assert app_client.post("/api/chat/batch", json={"messages": messages}).status_code == 200
+    assert app_client.post("/api/chat/batch", json={"messages": messages}).status_code == 429
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from coalesce import StreamCoalescer
+from usage import Usage
+
+
+@pytest.mark.anyio
+async def test_every_subscriber_gets_the_answer_and_is_charged():
+    coalescer = StreamCoalescer()
+    release = asyncio.Event()
+    started = []
+
+    async def generate(on_complete, on_usage):
+        started.append(True)
+        await release.wait()
+        yield b"data: hi\n\n"
+        usage = Usage()
+        usage.report(10, 2)
+        on_usage(usage)
+        await on_complete("hi")
+
+    answers, charges = [], []
+
+    def subscriber(name):
+        async def on_complete(text):
+            answers.append((name, text))
+        return coalescer.subscribe("k", generate, on_complete, lambda usage: charges.append((name, usage.total_tokens)))
+
+    first, second = subscriber("a"), subscriber("b")
+    release.set()
+    assert [frame async for frame in first] == [b"data: hi\n\n"]
+    assert [frame async for frame in second] == [b"data: hi\n\n"]
+    assert len(started) == 1
+    assert sorted(answers) == [("a", "hi"), ("b", "hi")]
+    assert sorted(charges) == [("a", 12), ("b", 12)]
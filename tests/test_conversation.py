@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+import conversation
+from conversation import ConversationStore, SQLiteConversationLog, build_context, estimate_tokens
+
+
+def turn(role, content):
+    return {"role": role, "content": content}
+
+
+def test_build_context_keeps_everything_that_fits():
+    history = [turn("user", "hi"), turn("assistant", "hello")]
+    assert build_context(history, "how are you", 1000, 200) == [*history, turn("user", "how are you")]
+
+
+def test_build_context_keeps_the_newest_turns_and_notes_the_dropped_questions():
+    history = [turn("user", "first question"), turn("assistant", "x" * 400),
+               turn("user", "second question"), turn("assistant", "short answer")]
+    messages = build_context(history, "third", 40, 200)
+    assert messages[-3:] == [history[2], history[3], turn("user", "third")]
+    assert messages[0] == turn("system", "Earlier in this conversation the user asked: first question")
+    assert len(messages) == 4
+
+
+def test_build_context_summary_is_bounded():
+    history = [turn("user", f"question {n} " + "q" * 100) for n in range(20)] + [turn("assistant", "y" * 4000)]
+    messages = build_context(history, "now", 100, 60)
+    note = messages[0]["content"]
+    assert messages[0]["role"] == "system"
+    assert estimate_tokens(note) <= 60
+    # The most recent dropped questions are the ones kept
+    assert "question 19" in note and "question 0 " not in note
+    # Without a summary budget, dropped turns just go
+    assert build_context(history, "now", 100, 0) == [turn("user", "now")]
+
+
+@pytest.mark.anyio
+async def test_store_caps_turns_and_sessions():
+    store = ConversationStore(max_sessions=2, idle_ttl=60, max_turns=4)
+    for n in range(3):
+        await store.append("a", turn("user", f"q{n}"), turn("assistant", f"a{n}"))
+    assert [t["content"] for t in await store.history("a")] == ["q1", "a1", "q2", "a2"]
+    await store.append("b", turn("user", "b"))
+    await store.append("c", turn("user", "c"))
+    # "a" was the least recently used of three sessions
+    assert await store.history("a") == []
+    assert await store.history("c") == [turn("user", "c")]
+
+
+@pytest.mark.anyio
+async def test_idle_sessions_are_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversation, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    store = ConversationStore(max_sessions=10, idle_ttl=60, max_turns=10)
+    await store.append("a", turn("user", "hi"))
+    now[0] += 30
+    assert await store.history("a") == [turn("user", "hi")]
+    now[0] += 61
+    assert await store.history("a") == []
+
+
+@pytest.mark.anyio
+async def test_sqlite_log_reloads_evicted_and_restarted_conversations(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+    store = ConversationStore(1, 60, 3, SQLiteConversationLog(path, 3600))
+    await store.append("a", turn("user", "q1"), turn("assistant", "a1"))
+    await store.append("b", turn("user", "other"))
+    # "a" was evicted from memory, so this reloads it before appending
+    await store.append("a", turn("user", "q2"), turn("assistant", "a2"))
+    assert [t["content"] for t in await store.history("a")] == ["a1", "q2", "a2"]
+    store.close()
+
+    restarted = ConversationStore(10, 60, 3, SQLiteConversationLog(path, 3600))
+    assert [t["content"] for t in await restarted.history("a")] == ["a1", "q2", "a2"]
+    restarted.close()
+
+
+def test_sqlite_log_drops_idle_conversations_on_open(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+    log = SQLiteConversationLog(path, 3600)
+    log.append("a", [turn("user", "hi")])
+    log.close()
+    # A negative idle TTL makes every conversation count as idle
+    reopened = SQLiteConversationLog(path, -1)
+    assert reopened.load("a", 10) == []
+    reopened.close()
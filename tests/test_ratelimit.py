@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdmissionController, MemoryBucketStore
+
+
+def test_bucket_allows_burst_then_reports_wait():
+    buckets = MemoryBucketStore(rate=1, burst=2)
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == 0
+    assert 0 < buckets.take("a") <= 1
+    # Other keys have their own bucket
+    assert buckets.take("b") == 0
+
+
+def test_bucket_charges_cost():
+    buckets = MemoryBucketStore(rate=1, burst=10)
+    assert buckets.take("a", 8) == 0
+    assert 0 < buckets.take("a", 3) <= 1
+    assert buckets.take("a", 2) == 0
+
+
+def test_cost_above_burst_leaves_bucket_in_debt():
+    buckets = MemoryBucketStore(rate=10, burst=10)
+    assert buckets.take("a", 50) == 0
+    # 40 tokens owed plus one to spend, at 10 a second
+    assert 4 < buckets.take("a") <= 4.1
+
+
+def test_bucket_store_is_bounded():
+    buckets = MemoryBucketStore(rate=1, burst=1, max_keys=2)
+    for key in "abc":
+        buckets.take(key)
+    assert len(buckets._buckets) == 2
+
+
+@pytest.mark.anyio
+async def test_admission_queues_then_hands_over_slot():
+    admission = AdmissionController(max_active=1, max_waiting=1, timeout=1)
+    assert await admission.acquire()
+    waiter = asyncio.ensure_future(admission.acquire())
+    await asyncio.sleep(0)
+    # Queue full: a third caller is refused at once
+    assert not await admission.acquire()
+    admission.release()
+    assert await waiter
+    assert admission.active == 1
+    admission.release()
+    assert admission.active == 0
+
+
+@pytest.mark.anyio
+async def test_admission_times_out():
+    admission = AdmissionController(max_active=1, max_waiting=5, timeout=0.05)
+    assert await admission.acquire()
+    assert not await admission.acquire()
+    assert admission.active == 1
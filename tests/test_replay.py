@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdmissionController
+from replay import ReplayStore, StreamGone, parse_last_event_id
+
+
+async def frames(count, delay=0.0):
+    for i in range(1, count + 1):
+        if delay:
+            await asyncio.sleep(delay)
+        yield f"data: {i}\n\n".encode()
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("abc:7", "abc") == 7
+    assert parse_last_event_id("other:7", "abc") == 0
+    assert parse_last_event_id("abc:x", "abc") == 0
+    assert parse_last_event_id(None, "abc") == 0
+
+
+@pytest.mark.anyio
+async def test_follow_numbers_frames_and_resumes_after_an_id():
+    store = ReplayStore(max_streams=10, max_frames=100, ttl=60, grace=5)
+    stream = store.start(frames(5))
+    first = b"".join([chunk async for chunk in stream.follow()])
+    assert first.count(b"id: ") == 5
+    assert f"id: {stream.id}:1\ndata: 1\n\n".encode() in first
+    rest = b"".join([chunk async for chunk in stream.follow(3)])
+    assert rest == f"id: {stream.id}:4\ndata: 4\n\nid: {stream.id}:5\ndata: 5\n\n".encode()
+    assert store.get(stream.id) is stream
+
+
+@pytest.mark.anyio
+async def test_check_rejects_ids_outside_the_buffer():
+    store = ReplayStore(max_streams=10, max_frames=2, ttl=60, grace=5)
+    stream = store.start(frames(10))
+    await stream.task
+    # At most 2 * max_frames are kept before the oldest are trimmed
+    assert stream.first_seq > 1
+    with pytest.raises(StreamGone):
+        stream.check(0)
+    with pytest.raises(StreamGone):
+        stream.check(stream.last_seq + 1)
+    stream.check(stream.last_seq)
+
+
+@pytest.mark.anyio
+async def test_generation_is_cancelled_after_grace_without_readers():
+    store = ReplayStore(max_streams=10, max_frames=100, ttl=60, grace=0.05)
+    stream = store.start(frames(100, delay=0.01))
+    reader = stream.follow()
+    await reader.__anext__()
+    await reader.aclose()
+    await asyncio.sleep(0.2)
+    assert stream.task.cancelled()
+    assert stream.done
+
+
+@pytest.mark.anyio
+async def test_admission_slot_is_held_until_the_generation_ends():
+    admission = AdmissionController(max_active=1, max_waiting=0, timeout=0)
+    assert await admission.acquire()
+    store = ReplayStore(max_streams=10, max_frames=100, ttl=60, grace=0.2)
+    stream = store.start(frames(100, delay=0.01), admission.release)
+    reader = stream.follow()
+    await reader.__anext__()
+    await reader.aclose()
+    # The reader is gone but the generation keeps going for the grace period
+    await asyncio.sleep(0.05)
+    assert admission.active == 1
+    await asyncio.wait([stream.task], timeout=1)
+    assert admission.active == 0
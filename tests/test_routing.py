@@ -0,0 +1,105 @@
+import time
+
+import httpx
+import pytest
+
+import chat
+from upstream import OPEN, Upstream, UpstreamRouter
+
+
+def make_router(*base_urls, hedge_default_delay=5.0):
+    upstreams = [Upstream(f"mock{i}", url, "mock", "") for i, url in enumerate(base_urls)]
+    return UpstreamRouter(upstreams, 0.3, 10, 2, 30, 0.95, 0.1, hedge_default_delay)
+
+
+async def complete(router, client=None):
+    async with httpx.AsyncClient() as own_client:
+        tokens = [t async for t in chat.stream_tokens(client or own_client, router, chat.build_payload(
+            [{"role": "user", "content": "hi"}]))]
+    return "".join(tokens)
+
+
+@pytest.mark.anyio
+async def test_streams_every_token(mock_upstream):
+    router = make_router(mock_upstream(ttft=0, token_interval=0, tokens=5))
+    assert await complete(router) == "The quick brown fox jumps"
+    assert router.upstreams[0].ewma_ttft is not None
+
+
+@pytest.mark.anyio
+async def test_retries_on_another_upstream_after_an_error(mock_upstream):
+    failing = mock_upstream(error_rate=1, error_status=503)
+    healthy = mock_upstream(ttft=0, token_interval=0, tokens=3)
+    router = make_router(failing, healthy)
+    # Make the failing upstream look fastest so it is tried first
+    router.upstreams[0].ewma_ttft, router.upstreams[1].ewma_ttft = 0.01, 1.0
+    assert await complete(router) == "The quick brown"
+    assert router.upstreams[0].breaker.failures == 1
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_max_retries(mock_upstream, monkeypatch):
+    monkeypatch.setattr(chat, "UPSTREAM_RETRY_BACKOFF", 0)
+    router = make_router(mock_upstream(error_rate=1, error_status=500))
+    with pytest.raises(chat.UpstreamError):
+        await complete(router)
+    # One attempt plus the retries, all against the only upstream: its circuit is now open
+    assert router.upstreams[0].breaker.state == OPEN
+
+
+@pytest.mark.anyio
+async def test_client_errors_are_not_retried(mock_upstream):
+    router = make_router(mock_upstream(error_rate=1, error_status=400))
+    with pytest.raises(chat.UpstreamError) as error:
+        await complete(router)
+    assert not error.value.retryable
+
+
+@pytest.mark.anyio
+async def test_hedges_a_slow_first_token(mock_upstream, monkeypatch):
+    monkeypatch.setattr(chat, "HEDGE_REQUESTS", True)
+    slow = mock_upstream(ttft=3, tokens=3)
+    fast = mock_upstream(ttft=0, token_interval=0, tokens=3)
+    router = make_router(slow, fast, hedge_default_delay=0.2)
+    router.upstreams[0].ewma_ttft, router.upstreams[1].ewma_ttft = 0.01, 1.0
+    started = time.monotonic()
+    assert await complete(router) == "The quick brown"
+    assert time.monotonic() - started < 2
+
+
+@pytest.mark.anyio
+async def test_does_not_hedge_on_the_same_upstream(mock_upstream, monkeypatch):
+    monkeypatch.setattr(chat, "HEDGE_REQUESTS", True)
+    attempts = []
+    iter_upstream_tokens = chat.iter_upstream_tokens
+
+    def counted(client, router, upstream, *args):
+        attempts.append(upstream)
+        return iter_upstream_tokens(client, router, upstream, *args)
+
+    monkeypatch.setattr(chat, "iter_upstream_tokens", counted)
+    router = make_router(mock_upstream(ttft=0.5, token_interval=0, tokens=3), hedge_default_delay=0.1)
+    assert await complete(router) == "The quick brown"
+    assert len(attempts) == 1
+
+
+@pytest.mark.anyio
+async def test_routes_to_the_lowest_ttft(mock_upstream):
+    first = mock_upstream(ttft=0, token_interval=0, tokens=2)
+    second = mock_upstream(ttft=0, token_interval=0, tokens=2)
+    router = make_router(first, second)
+    router.upstreams[0].ewma_ttft, router.upstreams[1].ewma_ttft = 2.0, 0.01
+    await complete(router)
+    assert len(router.upstreams[1].ttft_samples) == 1
+    assert not router.upstreams[0].ttft_samples
+
+
+@pytest.mark.anyio
+async def test_connection_goes_back_to_the_pool(mock_upstream):
+    router = make_router(mock_upstream(ttft=0, token_interval=0, tokens=3))
+    async with chat.create_http_client() as client:
+        for _ in range(3):
+            assert await complete(router, client) == "The quick brown"
+        connections = chat.pool_connections(client)
+        # Every stream stopped at [DONE] and reused the same keep-alive connection
+        assert len(connections) == 1
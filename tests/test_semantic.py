@@ -0,0 +1,20 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic import HASHING_MIN_THRESHOLD, create_semantic_cache
+
+
+@pytest.mark.anyio
+async def test_hashing_embedder_only_matches_near_verbatim_repeats():
+    cache = create_semantic_cache(True, "hashing", 0.9, 16, "")
+    assert cache.threshold == HASHING_MIN_THRESHOLD
+    await cache.add("Can I take ibuprofen with alcohol?", "with")
+    assert await cache.lookup("Can I take ibuprofen without alcohol?") is None
+    assert await cache.lookup("can i take ibuprofen with alcohol") == "with"
+
+
+def test_missing_model_falls_back_to_hashing(caplog):
+    cache = create_semantic_cache(True, "no-such-org/no-such-model", 0.9, 16, "")
+    assert cache.threshold == HASHING_MIN_THRESHOLD
+    assert "falling back to the hashing embedder" in caplog.text
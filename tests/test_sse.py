@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from sse import SSEParser, batch_tokens, encode_event, extract_content, idle_timeout, iter_sse_data
+
+
+def test_parser_joins_lines_split_across_chunks():
+    parser = SSEParser()
+    assert parser.feed(b'data: {"a"') == []
+    assert parser.feed(b': 1}\n') == []
+    assert parser.feed(b"\n") == [b'{"a": 1}']
+
+
+def test_parser_handles_crlf_comments_and_multiline_data():
+    parser = SSEParser()
+    events = parser.feed(b": keep-alive\r\n\r\nevent: x\r\ndata: one\r\ndata:two\r\n\r\n")
+    assert events == [b"one\ntwo"]
+
+
+def test_parser_close_flushes_unterminated_event():
+    parser = SSEParser()
+    assert parser.feed(b"data: tail") == []
+    assert parser.close() == [b"tail"]
+
+
+async def chunks(*items, delay=0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+@pytest.mark.anyio
+async def test_iter_sse_data_stops_at_done():
+    source = chunks(b"data: 1\n\ndata: [DONE]\n\n", b"data: 2\n\n")
+    assert [data async for data in iter_sse_data(source)] == [b"1"]
+
+
+def test_encode_event_round_trips_through_extract_content():
+    frame = encode_event({"content": "hi"})
+    assert frame.startswith(b"data: ") and frame.endswith(b"\n\n")
+    assert extract_content(b'{"choices": [{"delta": {"content": "hi"}}]}') == "hi"
+    assert extract_content(b'{"choices": []}') is None
+
+
+@pytest.mark.anyio
+async def test_batch_tokens_passes_first_token_alone_then_flushes_on_count():
+    batches = [b async for b in batch_tokens(chunks("a", "b", "c", "d", "e"), 2, 1024, 10)]
+    assert batches == ["a", "bc", "de"]
+
+
+@pytest.mark.anyio
+async def test_batch_tokens_flushes_on_bytes():
+    batches = [b async for b in batch_tokens(chunks("x", "aaaa", "bbbb", "c"), 100, 8, 10)]
+    assert batches == ["x", "aaaabbbb", "c"]
+
+
+@pytest.mark.anyio
+async def test_batch_tokens_flushes_on_interval():
+    async def slow():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    batches = [b async for b in batch_tokens(slow(), 100, 1024, 0.05)]
+    assert batches == ["a", "b", "c"]
+
+
+@pytest.mark.anyio
+async def test_idle_timeout_raises_when_tokens_stall():
+    received = []
+    with pytest.raises(TimeoutError):
+        async for token in idle_timeout(chunks("a", "b", delay=0.2), 0.05):
+            received.append(token)
+    assert received == []
@@ -0,0 +1,63 @@
+from upstream import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Upstream, UpstreamRouter
+
+
+def make_router(*names, **options):
+    settings = dict(alpha=0.5, probe_interval=1, failure_threshold=2, reset_timeout=10,
+                    hedge_percentile=0.95, hedge_min_delay=0.1, hedge_default_delay=1)
+    settings.update(options)
+    return UpstreamRouter([Upstream(name, f"http://{name}", "m", "") for name in names], **settings)
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_reset():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    assert not breaker.record_failure(0)
+    assert breaker.record_failure(1)
+    assert breaker.state == OPEN
+    assert not breaker.available(5)
+    assert breaker.available(11)
+    breaker.on_attempt(11)
+    assert breaker.state == HALF_OPEN
+    # Only one trial at a time
+    assert not breaker.available(12)
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_failure_reopens_at_once():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10)
+    breaker.state = OPEN
+    breaker.on_attempt(20)
+    assert breaker.record_failure(21)
+    assert breaker.state == OPEN
+
+
+def test_router_prefers_lowest_ttft_and_skips_open_circuits():
+    router = make_router("fast", "slow")
+    fast, slow = router.upstreams
+    router.observe(fast, 0.1)
+    router.observe(slow, 1.0)
+    assert router.pick() is fast
+    router.eject(fast)
+    router.eject(fast)
+    assert router.pick() is slow
+    # With every candidate's circuit open, fail open rather than refuse
+    assert router.pick(exclude=[slow]) is fast
+
+
+def test_hedge_delay_uses_percentile_once_sampled():
+    router = make_router("a", hedge_default_delay=3, hedge_min_delay=0.1)
+    upstream = router.upstreams[0]
+    assert router.hedge_delay(upstream) == 3
+    for i in range(100):
+        router.observe(upstream, i / 100)
+    assert router.hedge_delay(upstream) == 0.95
+
+
+def test_has_alternative_skips_tried_and_open_upstreams():
+    router = make_router("a", "b")
+    a, b = router.upstreams
+    assert router.has_alternative([a])
+    assert not router.has_alternative([a, b])
+    router.eject(b)
+    router.eject(b)
+    assert not router.has_alternative([a])
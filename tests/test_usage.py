@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from usage import SQLiteUsageLedger, Usage, UsageMeter
+
+
+def usage(prompt, completion):
+    result = Usage()
+    result.report(prompt, completion)
+    return result
+
+
+def test_settle_estimates_what_was_not_reported():
+    result = Usage().settle([{"role": "user", "content": "hello there"}], "hi")
+    assert result.estimated
+    assert result.prompt_tokens > 0 and result.completion_tokens > 0
+    assert not usage(3, 4).settle([], "").estimated
+
+
+def test_quota_is_checked_from_memory():
+    meter = UsageMeter(None, daily_quota=10, monthly_quota=0, flush_interval=1)
+    meter.record("a", usage(4, 4))
+    assert meter.exceeded("a") is None
+    meter.record("a", usage(1, 1))
+    assert meter.exceeded("a") == "day"
+    assert meter.exceeded("b") is None
+
+
+@pytest.mark.anyio
+async def test_flush_appends_batches_and_picks_up_other_workers(tmp_path):
+    path = str(tmp_path / "usage.sqlite3")
+    first = UsageMeter(SQLiteUsageLedger(path), 0, 0, 1)
+    second = UsageMeter(SQLiteUsageLedger(path), 0, 0, 1)
+    first.record("a", usage(10, 5))
+    first.record("a", usage(1, 1))
+    second.record("a", usage(100, 0))
+    await first.flush()
+    await second.flush()
+    await first.flush()
+    assert first.summary("a")["day_tokens"] == 117
+    assert first.summary("a")["month_tokens"] == 117
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.anyio
+async def test_flush_keeps_pending_usage_when_the_write_fails(tmp_path):
+    meter = UsageMeter(SQLiteUsageLedger(str(tmp_path / "usage.sqlite3")), 0, 0, 1)
+    meter.record("a", usage(2, 3))
+    meter.ledger.close()
+    with pytest.raises(sqlite3.Error):
+        await meter.flush()
+    assert sum(counts[1] + counts[2] for counts in meter._pending.values()) == 5
@@ -0,0 +1,71 @@
+import json
+import sqlite3
+
+import chat
+from test_routing import make_router
+
+
+def receive_until_done(ws, *request_ids):
+    """Control messages by request ID and the frame payloads each one got, once every ID is done"""
+    controls = {request_id: [] for request_id in request_ids}
+    frames = {request_id: b"" for request_id in request_ids}
+    pending = set(request_ids)
+    while pending:
+        message = ws.receive()
+        if message.get("bytes") is not None:
+            request_id, _, payload = message["bytes"].partition(b"\n")
+            frames[request_id.decode()] += payload
+            continue
+        control = json.loads(message["text"])
+        controls[control["id"]].append(control)
+        if control["type"] in ("done", "error"):
+            pending.discard(control["id"])
+    return controls, frames
+
+
+def content(frames):
+    return "".join(json.loads(line[len(b"data: "):])["content"]
+                   for line in frames.splitlines() if line.startswith(b"data: "))
+
+
+def test_streams_are_multiplexed_on_one_socket(app_client):
+    with app_client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "chat", "id": "a", "message": "first"})
+        ws.send_json({"type": "chat", "id": "b", "message": "second"})
+        controls, frames = receive_until_done(ws, "a", "b")
+    for request_id in ("a", "b"):
+        assert [c["type"] for c in controls[request_id]] == ["start", "done"]
+        assert content(frames[request_id]) == "The quick brown"
+    assert controls["a"][0]["conversation_id"] != controls["b"][0]["conversation_id"]
+
+
+def test_cancel_stops_one_stream(app_client, mock_upstream):
+    app_client.app.state.router = make_router(mock_upstream(ttft=0, token_interval=0.05, tokens=40))
+    with app_client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "chat", "id": "a", "message": "long"})
+        assert json.loads(ws.receive_text())["type"] == "start"
+        ws.send_json({"type": "cancel", "id": "a"})
+        controls, _ = receive_until_done(ws, "a")
+    assert controls["a"][-1] == {"type": "done", "id": "a", "cancelled": True}
+
+
+def test_duplicate_request_id_is_refused(app_client, mock_upstream):
+    app_client.app.state.router = make_router(mock_upstream(ttft=0, token_interval=0.05, tokens=20))
+    with app_client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "chat", "id": "a", "message": "long"})
+        ws.send_json({"type": "chat", "id": "a", "message": "again"})
+        controls, _ = receive_until_done(ws, "a")
+    # The first stream started; the second message with its ID was turned away
+    assert controls["a"][0]["type"] == "start"
+    assert controls["a"][-1] == {"type": "error", "id": "a", "status": 409, "detail": "Request ID already in use"}
+
+
+def test_unexpected_errors_are_reported(app_client, monkeypatch):
+    async def broken(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(chat, "prepare_turn", broken)
+    with app_client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "chat", "id": "a", "message": "hi"})
+        controls, _ = receive_until_done(ws, "a")
+    assert controls["a"] == [{"type": "error", "id": "a", "status": 500, "detail": "Internal server error"}]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Iterable, List, Optional
+
+import httpx
+
+logger = logging.getLogger("chat")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Open after `failure_threshold` consecutive failures, then allow one trial request per `reset_timeout`"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+
+    def available(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now - self.opened_at >= self.reset_timeout
+        # Half-open: one trial at a time, but don't let an abandoned trial block the upstream forever
+        return not self.trial_started or now - self.trial_started >= self.reset_timeout
+
+    def on_attempt(self, now: float) -> None:
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self.trial_started = now
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.trial_started = 0.0
+
+    def record_failure(self, now: float) -> bool:
+        """Count a failure; return True if this opened the circuit"""
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            opened = self.state != OPEN
+            self.state = OPEN
+            self.opened_at = now
+            self.trial_started = 0.0
+            return opened
+        return False
+
+
+class Upstream:
+    """One OpenAI-compatible provider/model with its recent latency and health"""
+
+    def __init__(self, name: str, base_url: str, model: str, api_key: str, weight: float = 1.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.weight = weight
+        self.ewma_ttft: Optional[float] = None
+        self.ttft_samples: Deque[float] = deque(maxlen=200)
+        self.breaker = CircuitBreaker(3, 30.0)
+        self.inflight = 0
+        self.headers = {
+            "Content-Type": "application/json",
+            "HTTP-Referer": "http://localhost:8000",
+            "X-Title": "AI Chatbot"
+        }
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state == CLOSED
+
+    def score(self) -> float:
+        """Expected time-to-first-token, inflated by load and discounted by weight (lower is better)"""
+        return (self.ewma_ttft or 0.0) * (1 + self.inflight) / self.weight
+
+
+def parse_upstreams(raw: str, default: Upstream) -> List[Upstream]:
+    """Read upstreams from a JSON list of {name, base_url, model, api_key, weight} objects"""
+    if not raw:
+        return [default]
+    return [
+        Upstream(
+            item.get("name", item["base_url"]),
+            item["base_url"],
+            item.get("model", default.model),
+            item.get("api_key", ""),
+            float(item.get("weight", 1.0)),
+        )
+        for item in json.loads(raw)
+    ]
+
+
+class UpstreamRouter:
+    """Send each request to the available upstream with the lowest EWMA time-to-first-token"""
+
+    def __init__(self, upstreams: List[Upstream], alpha: float, probe_interval: float,
+                 failure_threshold: int, reset_timeout: float,
+                 hedge_percentile: float, hedge_min_delay: float, hedge_default_delay: float):
+        self.upstreams = upstreams
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        for upstream in upstreams:
+            upstream.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def pick(self, exclude: Iterable[Upstream] = ()) -> Upstream:
+        now = time.monotonic()
+        candidates = [u for u in self.upstreams if u not in exclude] or self.upstreams
+        available = [u for u in candidates if u.breaker.available(now)]
+        if available:
+            upstream = min(available, key=Upstream.score)
+        else:
+            # Every circuit is open: fail open to the upstream that has been out the longest
+            upstream = min(candidates, key=lambda u: u.breaker.opened_at)
+        upstream.breaker.on_attempt(now)
+        return upstream
+
+    def has_alternative(self, exclude: Iterable[Upstream]) -> bool:
+        """Whether an upstream outside exclude could take a request now"""
+        now = time.monotonic()
+        return any(u not in exclude and u.breaker.available(now) for u in self.upstreams)
+
+    def observe(self, upstream: Upstream, ttft: float) -> None:
+        """Record a successful time-to-first-token"""
+        if upstream.ewma_ttft is None:
+            upstream.ewma_ttft = ttft
+        else:
+            upstream.ewma_ttft += self.alpha * (ttft - upstream.ewma_ttft)
+        upstream.ttft_samples.append(ttft)
+        upstream.breaker.record_success()
+
+    def eject(self, upstream: Upstream) -> None:
+        """Record a failure, opening the upstream's circuit once it crosses the threshold"""
+        if upstream.breaker.record_failure(time.monotonic()):
+            logger.warning("Opening circuit for upstream %s", upstream.name)
+
+    def hedge_delay(self, upstream: Upstream) -> float:
+        """How long to wait for a first token before hedging: the upstream's recent TTFT percentile"""
+        samples = upstream.ttft_samples
+        if len(samples) < 20:
+            return self.hedge_default_delay
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+        return max(self.hedge_min_delay, ordered[index])
+
+    async def probe(self, client: httpx.AsyncClient, upstream: Upstream) -> bool:
+        try:
+            response = await client.get(f"{upstream.base_url}/models", headers=upstream.headers,
+                                        timeout=self.probe_interval)
+        except httpx.HTTPError:
+            return False
+        return response.status_code < 500
+
+    async def run_health_checks(self, client: httpx.AsyncClient) -> None:
+        """Probe upstreams with an open circuit and let them take a trial request once they answer"""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            for upstream in self.upstreams:
+                if upstream.breaker.state == OPEN and await self.probe(client, upstream):
+                    logger.info("Re-admitting upstream %s", upstream.name)
+                    # Start from the fleet average so a recovered upstream is neither flooded nor starved
+                    observed = [u.ewma_ttft for u in self.upstreams if u.healthy and u.ewma_ttft is not None]
+                    upstream.ewma_ttft = sum(observed) / len(observed) if observed else None
+                    upstream.breaker.state = HALF_OPEN
+                    upstream.breaker.trial_started = 0.0
@@ -0,0 +1,226 @@
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from conversation import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+logger = logging.getLogger("chat")
+
+
+def count_tokens(text: str) -> int:
+    """Local token count for when an upstream doesn't report usage; tiktoken if installed, else an estimate"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+class Usage:
+    """Token usage of one generation, as reported by the upstream or estimated locally"""
+
+    def __init__(self):
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.estimated = False
+
+    @property
+    def total_tokens(self) -> int:
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
+
+    def report(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def settle(self, messages: Sequence[Dict[str, str]], completion: str) -> "Usage":
+        """Fill in whatever the upstream didn't report, e.g. for a stream cancelled before its usage chunk"""
+        if self.prompt_tokens is None:
+            self.prompt_tokens = sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+            self.estimated = True
+        if self.completion_tokens is None:
+            self.completion_tokens = count_tokens(completion) if completion else 0
+            self.estimated = True
+        return self
+
+
+def current_periods(now: Optional[datetime.datetime] = None) -> Tuple[str, str]:
+    """UTC (day, month) the quotas are counted in, e.g. ("2024-05-01", "2024-05")"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+
+def seconds_until(period: str, now: Optional[datetime.datetime] = None) -> int:
+    """Seconds until the current UTC "day" or "month" ends"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        end = start + datetime.timedelta(days=1)
+    else:
+        end = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+    return max(1, int((end - now).total_seconds()))
+
+
+class SQLiteUsageLedger:
+    """Append-only ledger of usage batches; totals are summed from it on demand"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, client TEXT NOT NULL, day TEXT NOT NULL, "
+            "requests INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "estimated_tokens INTEGER NOT NULL, recorded_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS usage_day ON usage (day, client)")
+
+    def append(self, rows: List[Tuple[str, str, int, int, int, int]]) -> None:
+        """rows are (client, day, requests, prompt_tokens, completion_tokens, estimated_tokens)"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO usage (client, day, requests, prompt_tokens, completion_tokens, estimated_tokens, "
+                "recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+
+    def totals(self, day: str, month: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Total tokens per client for the day and for the month"""
+        with self._lock:
+            month_rows = self._db.execute(
+                "SELECT client, day, SUM(prompt_tokens + completion_tokens) FROM usage "
+                "WHERE day >= ? AND day < ? GROUP BY client, day",
+                (f"{month}-01", f"{month}-99"),
+            ).fetchall()
+        daily: Dict[str, int] = {}
+        monthly: Dict[str, int] = {}
+        for client, row_day, tokens in month_rows:
+            monthly[client] = monthly.get(client, 0) + tokens
+            if row_day == day:
+                daily[client] = tokens
+        return daily, monthly
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class UsageMeter:
+    """Per-client token counters kept in memory, so quota checks never touch the database
+
+    Usage is aggregated per client and appended to the ledger every flush_interval seconds.
+    After each flush the totals are re-read from the ledger, which also picks up what other
+    worker processes have recorded.
+    """
+
+    def __init__(self, ledger: Optional[SQLiteUsageLedger], daily_quota: int, monthly_quota: int,
+                 flush_interval: float):
+        self.ledger = ledger
+        self.daily_quota = daily_quota
+        self.monthly_quota = monthly_quota
+        self.flush_interval = flush_interval
+        self.day, self.month = current_periods()
+        self._next_day = time.time() + seconds_until("day")
+        self.daily: Dict[str, int] = {}
+        self.monthly: Dict[str, int] = {}
+        # (client, day) -> [requests, prompt_tokens, completion_tokens, estimated_tokens] not yet in the ledger
+        self._pending: Dict[Tuple[str, str], List[int]] = {}
+
+    def _roll_over(self) -> None:
+        # One float comparison per call until midnight UTC
+        if time.time() < self._next_day:
+            return
+        self._next_day = time.time() + seconds_until("day")
+        day, month = current_periods()
+        if day != self.day:
+            self.daily.clear()
+        if month != self.month:
+            self.monthly.clear()
+        self.day, self.month = day, month
+
+    def record(self, client: str, usage: Usage) -> None:
+        self._roll_over()
+        tokens = usage.total_tokens
+        counts = self._pending.get((client, self.day))
+        if counts is None:
+            counts = self._pending[(client, self.day)] = [0, 0, 0, 0]
+        counts[0] += 1
+        counts[1] += usage.prompt_tokens or 0
+        counts[2] += usage.completion_tokens or 0
+        if usage.estimated:
+            counts[3] += tokens
+        self.daily[client] = self.daily.get(client, 0) + tokens
+        self.monthly[client] = self.monthly.get(client, 0) + tokens
+
+    def exceeded(self, client: str) -> Optional[str]:
+        """"day" or "month" if the client has used up that quota, else None"""
+        self._roll_over()
+        if self.daily_quota and self.daily.get(client, 0) >= self.daily_quota:
+            return "day"
+        if self.monthly_quota and self.monthly.get(client, 0) >= self.monthly_quota:
+            return "month"
+        return None
+
+    def summary(self, client: str) -> dict:
+        self._roll_over()
+        return {
+            "day": self.day,
+            "day_tokens": self.daily.get(client, 0),
+            "daily_quota": self.daily_quota or None,
+            "month": self.month,
+            "month_tokens": self.monthly.get(client, 0),
+            "monthly_quota": self.monthly_quota or None,
+        }
+
+    async def load(self) -> None:
+        if self.ledger is not None:
+            self.daily, self.monthly = await asyncio.to_thread(self.ledger.totals, self.day, self.month)
+
+    async def flush(self) -> None:
+        if self.ledger is None:
+            self._pending.clear()
+            return
+        pending, self._pending = self._pending, {}
+        day, month = self.day, self.month
+        if pending:
+            rows = [(client, row_day, *counts) for (client, row_day), counts in pending.items()]
+            try:
+                await asyncio.to_thread(self.ledger.append, rows)
+            except sqlite3.Error:
+                for key, counts in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0, 0, 0])
+                    for i, count in enumerate(counts):
+                        merged[i] += count
+                raise
+        daily, monthly = await asyncio.to_thread(self.ledger.totals, day, month)
+        # Add what was recorded while we were writing; it goes out with the next batch
+        for (client, row_day), counts in self._pending.items():
+            tokens = counts[1] + counts[2]
+            if row_day == day:
+                daily[client] = daily.get(client, 0) + tokens
+            monthly[client] = monthly.get(client, 0) + tokens
+        if (day, month) == (self.day, self.month):
+            self.daily, self.monthly = daily, monthly
+
+    async def run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Usage flush failed: %s", e)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self.ledger is not None:
+            self.ledger.close()